@@ -0,0 +1,227 @@
+# benchmark.py
+"""Воспроизводимые замеры производительности модуля encryption.
+
+Каждый сценарий создаёт синтетическое дерево во временной директории,
+шифрует и дешифрует его и сообщает МБ/с, файлов/с и пиковый RSS. Сценарии
+выполняются в отдельных процессах, чтобы пиковая память не смешивалась.
+
+Примеры:
+    python benchmark.py --output base.json
+    python benchmark.py --profile quick --compare base.json --threshold 0.15
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 * 1024
+SEED = 1234
+PASSWORD = "benchmark"
+
+# Профили сценариев: число файлов, размеры по кругу и признак разрежённых файлов
+PROFILES = {
+    'quick': {
+        'tiny': {'count': 2000, 'sizes': [1024]},
+        'mixed': {'count': 300, 'sizes': [1024, 64 * 1024, 512 * 1024, 4 * MB]},
+        'large': {'count': 1, 'sizes': [256 * MB], 'sparse': True},
+    },
+    'full': {
+        'tiny': {'count': 20000, 'sizes': [1024]},
+        'mixed': {'count': 2000, 'sizes': [1024, 64 * 1024, 512 * 1024, 4 * MB, 32 * MB]},
+        'large': {'count': 3, 'sizes': [2048 * MB], 'sparse': True},
+    },
+}
+
+# Метрики, где больше — лучше; для остальных (время, память) лучше меньше
+HIGHER_IS_BETTER = ('mb_per_s', 'files_per_s')
+# Как часто проверять, жив ли процесс сценария, пока итога нет
+_RESULT_POLL_SECONDS = 1.0
+
+
+def peak_rss_mb():
+    """Пиковый RSS текущего процесса в МБ (None, если недоступно)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS — байты
+    return round(peak / (MB if sys.platform == 'darwin' else 1024), 1)
+
+
+def build_tree(root, spec):
+    """Создаёт дерево файлов по описанию сценария, возвращает общий объём."""
+    rng = random.Random(SEED)
+    total = 0
+    for i in range(spec['count']):
+        size = spec['sizes'][i % len(spec['sizes'])]
+        directory = os.path.join(root, f'd{i // 500:03d}')
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f'f{i:06d}.bin'), 'wb') as f:
+            if spec.get('sparse'):
+                f.truncate(size)  # Разрежённый файл: не занимает место, читается как нули
+            else:
+                f.write(rng.randbytes(size))
+        total += size
+    return total
+
+
+def run_scenario(name, spec, options, results):
+    """Выполняет один сценарий (в дочернем процессе) и кладёт итог в results."""
+    import encryption
+    root = tempfile.mkdtemp(prefix=f'sticknest-bench-{name}-', dir=options.get('tmpdir'))
+    try:
+        total = build_tree(root, spec)
+        key = encryption.KeyChain(PASSWORD)
+        key.master_key()  # Вывод ключа замеряется отдельно
+        report = {'files': spec['count'], 'bytes': total}
+        for action, func in (('encrypt', encryption.encrypt_directory),
+                             ('decrypt', encryption.decrypt_directory)):
+            start = time.perf_counter()
+            summary = func(root, key, workers=options.get('workers'))
+            seconds = time.perf_counter() - start
+            if not summary.ok:
+                raise RuntimeError(f'{name}/{action}: {summary.failures[:3]}')
+            report[action] = {
+                'seconds': round(seconds, 4),
+                'mb_per_s': round(total / MB / seconds, 2),
+                'files_per_s': round(spec['count'] / seconds, 1),
+            }
+        report['peak_rss_mb'] = peak_rss_mb()
+        results.put((name, report, None))
+    except Exception as e:
+        results.put((name, None, f'{type(e).__name__}: {e}'))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def measure_kdf(repeat=3):
+    """Замеряет задержку вывода мастер-ключа (лучшее из repeat попыток)."""
+    import encryption
+    timings = {}
+    for label, derive in (
+            ('pbkdf2_master', lambda: encryption.KeyChain(PASSWORD).master_key()),
+            ('scrypt_min', lambda: encryption.KeyChain(PASSWORD, kdf={
+                'algorithm': encryption.KDF_SCRYPT, 'n': encryption.SCRYPT_MIN_N,
+                'r': encryption.SCRYPT_R, 'p': encryption.SCRYPT_P}).master_key()),
+            ('pbkdf2_legacy', lambda: encryption.generate_key(PASSWORD.encode()))):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            derive()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[label] = {'seconds': round(best, 4)}
+    return timings
+
+
+def run(profile, options):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    report = {
+        'meta': {
+            'profile': profile,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'workers': options.get('workers'),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'scenarios': {},
+        'kdf': measure_kdf(),
+    }
+    for name, spec in PROFILES[profile].items():
+        if options.get('only') and name not in options['only']:
+            continue
+        process = context.Process(target=run_scenario, args=(name, spec, options, results))
+        process.start()
+        _, scenario, error = _wait_result(process, results)
+        process.join()
+        if error:
+            raise RuntimeError(f'{name}: {error}')
+        report['scenarios'][name] = scenario
+    return report
+
+
+def _wait_result(process, results):
+    """Ждёт итог сценария; если процесс завершился без итога (например,
+    убит из-за нехватки памяти), возвращает ошибку вместо вечного ожидания."""
+    while True:
+        try:
+            return results.get(timeout=_RESULT_POLL_SECONDS)
+        except queue.Empty:
+            if process.exitcode is None:
+                continue
+        # Итог мог попасть в очередь сразу перед выходом процесса
+        try:
+            return results.get(timeout=_RESULT_POLL_SECONDS)
+        except queue.Empty:
+            return None, None, f'процесс сценария завершился с кодом {process.exitcode} без результата'
+
+
+def iter_metrics(report):
+    """Перебирает метрики отчёта как (имя, значение, больше_лучше)."""
+    for name, scenario in report['scenarios'].items():
+        for action in ('encrypt', 'decrypt'):
+            for metric, value in scenario.get(action, {}).items():
+                yield f'{name}.{action}.{metric}', value, metric in HIGHER_IS_BETTER
+        if scenario.get('peak_rss_mb') is not None:
+            yield f'{name}.peak_rss_mb', scenario['peak_rss_mb'], False
+    for label, values in report.get('kdf', {}).items():
+        yield f'kdf.{label}.seconds', values['seconds'], False
+
+
+def compare(current, baseline, threshold):
+    """Возвращает список регрессий больше threshold относительно baseline."""
+    previous = {name: value for name, value, _ in iter_metrics(baseline)}
+    regressions = []
+    for name, value, higher_is_better in iter_metrics(current):
+        old = previous.get(name)
+        if not old:
+            continue
+        change = (value - old) / old
+        if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+            regressions.append({'metric': name, 'baseline': old, 'current': value,
+                                'change': round(change, 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности StickNest.")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='full')
+    parser.add_argument('--only', nargs='+', metavar='SCENARIO', help='запустить только эти сценарии')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--tmpdir', default=None, help='где создавать деревья (например, на USB-носителе)')
+    parser.add_argument('--output', help='записать результаты в JSON-файл')
+    parser.add_argument('--compare', metavar='BASELINE', help='сравнить с предыдущим JSON-отчётом')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='допустимое ухудшение метрики (доля, по умолчанию 0.10)')
+    args = parser.parse_args(argv)
+
+    report = run(args.profile, {'workers': args.workers, 'tmpdir': args.tmpdir, 'only': args.only})
+    code = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['regressions'] = compare(report, baseline, args.threshold)
+        code = 1 if report['regressions'] else 0
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,446 @@
+# cli.py
+"""Консольный интерфейс StickNest без графической оболочки.
+
+Примеры:
+    STICKNEST_PASSWORD=secret python -m cli encrypt /media/usb --workers 8
+    echo secret | python -m cli decrypt /media/usb --password-stdin
+    python -m cli scan /media/usb
+    STICKNEST_PASSWORD=secret python -m cli watch /media/usb
+    tar c docs | STICKNEST_PASSWORD=secret python -m cli encrypt-pipe > /media/usb/docs.tar.snest
+
+Результат печатается в stdout одной строкой JSON (кроме команд cat,
+encrypt-pipe и decrypt-pipe, которые выводят сами данные; их ошибки
+печатаются в stderr). Модуль шифрования
+импортируется только при выполнении команды, поэтому запуск быстрый.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+PASSWORD_ENV = "STICKNEST_PASSWORD"
+
+# Коды завершения
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_USAGE = 2
+
+
+class CliError(Exception):
+    """Ошибка параметров командной строки."""
+
+
+def read_password(args):
+    """Читает пароль из stdin или из переменной окружения."""
+    if args.password_stdin:
+        password = sys.stdin.readline().rstrip("\r\n")
+    else:
+        password = os.environ.get(args.password_env, "")
+    if not password:
+        raise CliError(f"Пароль не задан: используйте --password-stdin или переменную {args.password_env}.")
+    return password
+
+
+def make_key(args):
+    """Возвращает ключ для задачи: из файла ключа или из пароля."""
+    import encryption
+    if args.key_file:
+        return encryption.load_key(args.key_file)
+    password = read_password(args)
+    kdf = None
+    if getattr(args, 'kdf', None):
+        kdf = encryption.calibrate_kdf(args.kdf_time, args.kdf)
+    return encryption.KeyChain(password, kdf=kdf)
+
+
+def job_options(args):
+    options = {'workers': args.workers, 'use_processes': args.processes}
+    if args.buffer_size:
+        options['buffer_size'] = args.buffer_size
+    if args.per_device:
+        options['per_device'] = args.per_device
+    if getattr(args, 'compress', None):
+        options['compression'] = args.compress
+    if getattr(args, 'cipher', None):
+        options['cipher'] = args.cipher
+    return options
+
+
+def run_job(args, action):
+    import encryption
+    if getattr(args, 'to', None) and len(args.paths) != 1:
+        raise CliError("С --to укажите ровно один исходный путь.")
+    key = make_key(args)
+    try:
+        if action == 'encrypt' and isinstance(key, encryption.KeyChain) and args.save_key:
+            encryption.save_key(key, args.save_key)
+        func = {'encrypt': encryption.encrypt_paths,
+                'decrypt': encryption.decrypt_paths,
+                'verify': encryption.verify_paths,
+                'resume': encryption.resume_paths}[action]
+        if getattr(args, 'to', None):
+            # Копирование в другое дерево: источник не изменяется
+            tree_func = {'encrypt': encryption.encrypt_tree, 'decrypt': encryption.decrypt_tree}[action]
+            func = lambda paths, key, **options: tree_func(paths[0], args.to, key, **options)
+        recorder = None
+        if args.trace:
+            from tracing import TraceRecorder
+            recorder = TraceRecorder()
+            encryption.add_observer(recorder)
+        try:
+            summary = func(args.paths, key, **job_options(args))
+        except ValueError as e:
+            # Ошибки отдельных файлов попадают в итоги; сюда доходят ошибки параметров
+            raise CliError(str(e)) from None
+        finally:
+            if recorder is not None:
+                encryption.remove_observer(recorder)
+    finally:
+        if isinstance(key, encryption.KeyChain):
+            key.close()
+    result = {'command': action}
+    result.update(summary.to_dict())
+    if recorder is not None:
+        recorder.export_chrome(args.trace)
+        result['phases'] = recorder.totals()
+    return result, EXIT_OK if summary.ok else EXIT_FAILURES
+
+
+def cmd_encrypt(args):
+    return run_job(args, 'encrypt')
+
+
+def cmd_decrypt(args):
+    return run_job(args, 'decrypt')
+
+
+def cmd_verify(args):
+    return run_job(args, 'verify')
+
+
+def cmd_resume(args):
+    """Продолжает задачу, прерванную на этих путях (по журналу на носителе)."""
+    import encryption
+    action = encryption.interrupted_action(args.paths)
+    if action is None:
+        raise CliError("Нет прерванной задачи для продолжения.")
+    result, code = run_job(args, 'resume')
+    result['action'] = action
+    return result, code
+
+
+def cmd_pack(args):
+    import encryption
+    key = make_key(args)
+    try:
+        summary = encryption.pack_directory(args.directory, args.container, key,
+                                            remove_sources=args.remove_sources, cipher=args.cipher)
+    except (ValueError, OSError) as e:
+        raise CliError(str(e)) from None
+    finally:
+        if isinstance(key, encryption.KeyChain):
+            key.close()
+    result = {'command': 'pack', 'container': args.container}
+    result.update(summary.to_dict())
+    return result, EXIT_OK if summary.ok else EXIT_FAILURES
+
+
+def cmd_unpack(args):
+    import encryption
+    key = make_key(args)
+    try:
+        if args.member:
+            summary = encryption.JobSummary()
+            for name in args.member:
+                encryption.extract_file(args.container, key, name,
+                                        os.path.join(args.directory, *name.split('/')))
+                summary.files_done += 1
+            summary.files_total = summary.files_done
+        else:
+            summary = encryption.unpack_container(args.container, key, args.directory)
+    except KeyError as e:
+        raise CliError(e.args[0]) from None
+    except (ValueError, OSError) as e:
+        # Неверный пароль, повреждённый контейнер или ошибка чтения
+        raise CliError(str(e)) from None
+    finally:
+        if isinstance(key, encryption.KeyChain):
+            key.close()
+    result = {'command': 'unpack', 'container': args.container}
+    result.update(summary.to_dict())
+    return result, EXIT_OK if summary.ok else EXIT_FAILURES
+
+
+def cmd_list(args):
+    import encryption
+    key = make_key(args)
+    try:
+        entries = encryption.list_container(args.container, key)
+    except (ValueError, OSError) as e:
+        raise CliError(str(e)) from None
+    finally:
+        if isinstance(key, encryption.KeyChain):
+            key.close()
+    return {'command': 'list', 'container': args.container, 'files': entries}, EXIT_OK
+
+
+def cmd_cat(args):
+    """Выводит в stdout диапазон открытых данных файла, не дешифруя его целиком."""
+    import encryption
+    key = make_key(args)
+    try:
+        with encryption.open_encrypted(args.file, key) as reader:
+            reader.seek(args.offset)
+            remaining = args.length
+            while remaining is None or remaining > 0:
+                size = encryption.CHUNK_SIZE if remaining is None else min(remaining, encryption.CHUNK_SIZE)
+                data = reader.read(size)
+                if not data:
+                    break
+                sys.stdout.buffer.write(data)
+                if remaining is not None:
+                    remaining -= len(data)
+        sys.stdout.buffer.flush()
+    except BrokenPipeError:
+        return close_stdout()
+    except (ValueError, OSError) as e:
+        # Не зашифрованный файл, неверный пароль или повреждённый фрагмент
+        raise CliError(str(e)) from None
+    finally:
+        if isinstance(key, encryption.KeyChain):
+            key.close()
+    return None, EXIT_OK
+
+
+def close_stdout():
+    """Отбрасывает остаток вывода, если читатель закрыл канал раньше конца (например, head).
+
+    Иначе интерпретатор сообщил бы об ошибке при сбросе stdout на выходе.
+    """
+    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return None, EXIT_FAILURES
+
+
+def run_pipe(args, action):
+    """Шифрует или дешифрует stdin в stdout без временных файлов."""
+    import encryption
+    key = make_key(args)
+    try:
+        if action == 'encrypt':
+            encryption.encrypt_stream(sys.stdin.buffer, sys.stdout.buffer, key, compression=args.compress,
+                                      cipher=args.cipher, workers=args.workers)
+        else:
+            encryption.decrypt_stream(sys.stdin.buffer, sys.stdout.buffer, key, workers=args.workers)
+        sys.stdout.buffer.flush()
+    except ValueError as e:
+        # Повреждённый поток, неверный пароль или недопустимые параметры
+        raise CliError(str(e)) from None
+    except BrokenPipeError:
+        return close_stdout()
+    finally:
+        if isinstance(key, encryption.KeyChain):
+            key.close()
+    return None, EXIT_OK
+
+
+def cmd_encrypt_pipe(args):
+    return run_pipe(args, 'encrypt')
+
+
+def cmd_decrypt_pipe(args):
+    return run_pipe(args, 'decrypt')
+
+
+def cmd_watch(args):
+    """Шифрует новые и изменённые файлы в папке, пока не нажато Ctrl+C или носитель не извлечён.
+
+    После каждого пакета в stdout печатается строка JSON с его итогами.
+    """
+    import encryption
+    import watch
+    key = make_key(args)
+    batches = 0
+
+    def on_batch(summary):
+        nonlocal batches
+        batches += 1
+        result = {'command': 'watch', 'batch': batches}
+        result.update(summary.to_dict())
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+    try:
+        with watch.Watcher(args.directory, key, quiet=args.quiet, stable=args.stable,
+                           poll_interval=args.poll_interval, use_inotify=not args.poll,
+                           **job_options(args)) as watcher:
+            watcher.run(on_batch=on_batch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if isinstance(key, encryption.KeyChain):
+            key.close()
+    return {'command': 'watch', 'batches': batches}, EXIT_OK
+
+
+def cmd_scan(args):
+    """Составляет план: файлы, объёмы по устройствам, уже зашифрованные и оценку времени."""
+    import encryption
+    plan = encryption.scan_paths(args.paths)
+    bytes_per_second = args.throughput * 1024 * 1024 if args.throughput else None
+    result = {'command': 'scan'}
+    result.update(plan.to_dict(bytes_per_second))
+    if args.list:
+        result['files'] = [entry._asdict() for entry in plan.entries]
+    return result, EXIT_FAILURES if plan.failures else EXIT_OK
+
+
+def cmd_calibrate(args):
+    """Подбирает параметры KDF под заданное время вывода ключа на этой машине."""
+    import encryption
+    params = encryption.calibrate_kdf(args.target, args.algorithm)
+    return {'command': 'calibrate', 'target_seconds': args.target, 'kdf': params}, EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="sticknest", description="Шифрование файлов на USB-накопителях.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_key_options(sub, password_stdin=True):
+        if password_stdin:
+            sub.add_argument("--password-stdin", action="store_true",
+                             help="прочитать пароль из первой строки stdin")
+        else:
+            # В потоковых командах stdin занят данными, и пароль из него не читается
+            sub.set_defaults(password_stdin=False)
+        sub.add_argument("--password-env", default=PASSWORD_ENV, metavar="VAR",
+                         help=f"переменная окружения с паролем (по умолчанию {PASSWORD_ENV})")
+        sub.add_argument("--key-file", help="использовать сохранённый файл ключа вместо пароля")
+
+    def add_job_options(sub, trace=True):
+        sub.add_argument("--workers", type=int, default=None, help="число параллельных обработчиков")
+        sub.add_argument("--processes", action="store_true", help="использовать процессы вместо потоков")
+        sub.add_argument("--buffer-size", type=int, default=None, metavar="BYTES",
+                         help="размер блока чтения/записи (по умолчанию 4 МБ)")
+        sub.add_argument("--per-device", type=int, default=None, metavar="N",
+                         help="сколько файлов одновременно обрабатывать на одном носителе")
+        if trace:
+            sub.add_argument("--trace", metavar="FILE",
+                             help="записать трассу фаз в формате Chrome Trace (только для потоков)")
+
+    def add_cipher_option(sub):
+        sub.add_argument("--cipher", choices=("auto", "fernet", "aes-256-gcm", "chacha20-poly1305"),
+                         help="шифр фрагментов (по умолчанию auto — самый быстрый на этой машине)")
+
+    def add_destination_option(sub):
+        sub.add_argument("--to", metavar="DEST",
+                         help="записать результат в папку DEST, не изменяя исходные файлы")
+
+    for name, handler, help_text in (
+            ("encrypt", cmd_encrypt, "зашифровать файлы и папки"),
+            ("decrypt", cmd_decrypt, "дешифровать файлы и папки"),
+            ("verify", cmd_verify, "проверить, что файлы дешифруются, ничего не записывая"),
+            ("resume", cmd_resume, "продолжить прерванное шифрование или дешифрование")):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("paths", nargs="+")
+        add_key_options(sub)
+        add_job_options(sub)
+        sub.set_defaults(handler=handler)
+    add_destination_option(subparsers.choices["encrypt"])
+    add_destination_option(subparsers.choices["decrypt"])
+    subparsers.choices["encrypt"].add_argument("--save-key", metavar="FILE",
+                                               help="добавить мастер-ключ задачи в файл ключа "
+                                                    "(файл хранит ключи всех задач, сохранённых в него)")
+
+    def add_encrypt_options(sub):
+        sub.add_argument("--compress", choices=("auto", "zlib", "lzma", "zstd"),
+                         help="сжимать перед шифрованием хорошо сжимаемые файлы")
+        sub.add_argument("--kdf", choices=("pbkdf2-sha256", "scrypt"),
+                         help="подобрать параметры этого KDF под --kdf-time")
+        sub.add_argument("--kdf-time", type=float, default=0.5, metavar="SECONDS",
+                         help="желаемое время вывода ключа (по умолчанию 0.5 с)")
+        add_cipher_option(sub)
+
+    add_encrypt_options(subparsers.choices["encrypt"])
+
+    for name, handler, help_text in (
+            ("encrypt-pipe", cmd_encrypt_pipe, "зашифровать stdin в stdout"),
+            ("decrypt-pipe", cmd_decrypt_pipe, "дешифровать stdin в stdout")):
+        sub = subparsers.add_parser(name, help=help_text)
+        add_key_options(sub, password_stdin=False)
+        sub.add_argument("--workers", type=int, default=None, help="число потоков шифрования")
+        sub.set_defaults(handler=handler, binary_output=True)
+    add_encrypt_options(subparsers.choices["encrypt-pipe"])
+
+    watch = subparsers.add_parser("watch", help="шифровать новые файлы в папке по мере появления")
+    watch.add_argument("directory")
+    watch.add_argument("--quiet", type=float, default=2.0, metavar="SECONDS",
+                       help="сколько секунд без изменений ждать перед шифрованием пакета")
+    watch.add_argument("--stable", type=float, default=1.0, metavar="SECONDS",
+                       help="сколько секунд файл не должен меняться, чтобы считаться дописанным")
+    watch.add_argument("--poll", action="store_true", help="обходить папку вместо inotify")
+    watch.add_argument("--poll-interval", type=float, default=5.0, metavar="SECONDS",
+                       help="период обхода папки без inotify")
+    add_key_options(watch)
+    add_job_options(watch, trace=False)
+    add_encrypt_options(watch)
+    watch.set_defaults(handler=cmd_watch)
+
+    pack = subparsers.add_parser("pack", help="упаковать папку в один зашифрованный контейнер")
+    pack.add_argument("directory")
+    pack.add_argument("container")
+    pack.add_argument("--remove-sources", action="store_true",
+                      help="удалить исходные файлы после записи контейнера")
+    add_key_options(pack)
+    add_cipher_option(pack)
+    pack.set_defaults(handler=cmd_pack)
+
+    unpack = subparsers.add_parser("unpack", help="извлечь файлы из контейнера")
+    unpack.add_argument("container")
+    unpack.add_argument("directory")
+    unpack.add_argument("--member", nargs="+", metavar="NAME", help="извлечь только эти файлы")
+    add_key_options(unpack)
+    unpack.set_defaults(handler=cmd_unpack)
+
+    listing = subparsers.add_parser("list", help="показать содержимое контейнера")
+    listing.add_argument("container")
+    add_key_options(listing)
+    listing.set_defaults(handler=cmd_list)
+
+    cat = subparsers.add_parser("cat", help="вывести диапазон открытых данных файла в stdout")
+    cat.add_argument("file")
+    cat.add_argument("--offset", type=int, default=0, help="начальная позиция, байт")
+    cat.add_argument("--length", type=int, default=None, help="число байт (по умолчанию до конца)")
+    add_key_options(cat)
+    cat.set_defaults(handler=cmd_cat, binary_output=True)
+
+    scan = subparsers.add_parser("scan", help="посчитать файлы и объём, не расшифровывая")
+    scan.add_argument("paths", nargs="+")
+    scan.add_argument("--throughput", type=float, metavar="MB/S",
+                      help="скорость для оценки времени (по умолчанию — замер на этой машине)")
+    scan.add_argument("--list", action="store_true", help="включить в вывод список файлов")
+    scan.set_defaults(handler=cmd_scan)
+
+    calibrate = subparsers.add_parser("calibrate", help="подобрать параметры KDF для этой машины")
+    calibrate.add_argument("--algorithm", choices=("pbkdf2-sha256", "scrypt"), default="pbkdf2-sha256")
+    calibrate.add_argument("--target", type=float, default=0.5, metavar="SECONDS",
+                           help="желаемое время вывода ключа (по умолчанию 0.5 с)")
+    calibrate.set_defaults(handler=cmd_calibrate)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        result, code = args.handler(args)
+    except CliError as e:
+        # Команды, выводящие данные, не должны смешивать с ними сообщение об ошибке
+        out = sys.stderr if getattr(args, 'binary_output', False) else sys.stdout
+        print(json.dumps({'command': args.command, 'error': str(e)}, ensure_ascii=False), file=out)
+        return EXIT_USAGE
+    if result is not None:
+        print(json.dumps(result, ensure_ascii=False))
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
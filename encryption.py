@@ -1,61 +1,2298 @@
-from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag, UnsupportedAlgorithm
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from cryptography.hazmat.primitives import hashes
 import os
 import base64
+import collections
+import contextlib
+import functools
+import hashlib
+import hmac
+import io
+import json
+import lzma
+import queue
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
 
-def generate_key(password):
-    """Генерирует ключ на основе пароля."""
-    salt = b'salt_1234567890'  # Случайная соль
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-    )
+from journal import JournalSet
+from manifest import RESERVED_PREFIX, ManifestSet
+from scheduler import DEVICE_WORKERS, DeviceScheduler
+
+try:
+    import zstandard  # Необязательная зависимость: быстрее zlib при лучшем сжатии
+except ImportError:
+    zstandard = None
+
+# Формат зашифрованного файла (версии 1 и 2):
+#   MAGIC | версия (1 байт) | длина заголовка (4 байта) | заголовок JSON
+#   далее записи: длина токена (4 байта) | токен одного фрагмента.
+# Каждый токен привязан к кадру: хэшу заголовка, номеру фрагмента и признаку
+# последнего фрагмента, поэтому перестановка, подмена или обрезка
+# фрагментов обнаруживается при дешифровании.
+#
+# В версии 1 токен — Fernet (AES-128-CBC и HMAC в base64), кадр лежит внутри
+# токена. В версии 2 шифр записан в поле заголовка 'cipher' (AES-256-GCM или
+# ChaCha20-Poly1305): токен — байт признака последнего фрагмента и двоичный
+# шифротекст с тегом, кадр передаётся как связанные данные, а nonce — это
+# префикс из поля 'nonce' и номер фрагмента. Такой токен длиннее открытых
+# данных всего на 17 байт, а не на треть, как у Fernet.
+#
+# Фрагменты шифруются случайным ключом данных файла. Он хранится в заголовке
+# ('wrapped_key'), зашифрованный мастер-ключом; мастер-ключ выводится из
+# пароля по полю 'kdf': алгоритм ('pbkdf2-sha256' или 'scrypt'), соль и
+# параметры алгоритма. Поле без алгоритма — PBKDF2 с 'iterations'. Так KDF
+# выполняется один раз на задачу, а не на каждый файл.
+MAGIC = b'\x00SNEST'
+FORMAT_VERSION = 2
+_FERNET_FORMAT_VERSION = 1
+CHUNK_SIZE = 1024 * 1024  # Размер открытого фрагмента, байт
+# Наибольший размер фрагмента: заголовок читается до проверки подлинности,
+# и больший размер из повреждённого файла не должен приводить к огромным буферам
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# Размер блока чтения и буфера записи. Крупные блоки, кратные фрагменту,
+# заметно быстрее на USB-флеш; значение можно подбирать под класс носителя
+BUFFER_SIZE = 4 * 1024 * 1024
+# Как часто крупный файл отмечает в журнале задачи контрольную точку, байт
+CHECKPOINT_SIZE = 64 * 1024 * 1024
+
+# Контейнер: тот же заголовок с другой сигнатурой, затем фрагменты общего
+# потока всех файлов дерева, зашифрованный индекс и хвост со ссылкой на него
+CONTAINER_MAGIC = b'\x00SNPAK'
+CONTAINER_SUFFIX = '.snpak'
+
+_HEADER_PREFIX = struct.Struct('>BI')
+_RECORD_LEN = struct.Struct('>I')
+_FRAME = struct.Struct('>16sQ?')
+_TRAILER = struct.Struct('>QI6s')  # Смещение индекса, его длина, сигнатура
+_INDEX_FRAME = 2 ** 64 - 1  # Номер кадра, которым помечен индекс контейнера
+_MAX_HEADER_SIZE = 64 * 1024
+_TEMP_SUFFIX = '.sntmp'
+# Начало Fernet-токена (версия 0x80 в base64) у файлов старого формата
+_LEGACY_PREFIX = b'gAAAAA'
+
+# Параметры PBKDF2 для мастер-ключа. Вывод выполняется один раз на задачу,
+# поэтому число итераций можно держать высоким
+KDF_ITERATIONS = 600000
+SALT_SIZE = 16
+
+# Алгоритмы вывода мастер-ключа
+KDF_PBKDF2 = 'pbkdf2-sha256'
+KDF_SCRYPT = 'scrypt'
+KDF_ALGORITHMS = (KDF_PBKDF2, KDF_SCRYPT)
+# Время вывода ключа, под которое по умолчанию подбирает параметры calibrate_kdf
+KDF_TARGET_SECONDS = 0.5
+# Границы параметров: калибровка не опускается ниже минимума даже на
+# медленных машинах, а заголовки с параметрами выше максимума отвергаются
+KDF_MIN_ITERATIONS = 100000
+KDF_MAX_ITERATIONS = 20000000
+SCRYPT_MIN_N = 2 ** 14
+SCRYPT_MAX_N = 2 ** 18  # 256 МБ памяти при r=8
+SCRYPT_R = 8
+SCRYPT_P = 1
+# Заголовок читается до проверки ключа, поэтому его параметры scrypt
+# ограничены: память 128*n*r байт и число проходов p
+SCRYPT_MAX_MEMORY = 256 * 1024 * 1024
+SCRYPT_MAX_P = 4
+# Фиксированная соль файлов, зашифрованных до появления заголовков
+_LEGACY_SALT = b'salt_1234567890'
+_LEGACY_ITERATIONS = 100000
+
+# Шифры фрагментов. 'auto' выбирает более быстрый из двух AEAD-шифров на
+# этой машине (см. choose_cipher): AES-256-GCM с аппаратным AES или
+# ChaCha20-Poly1305 без него
+CIPHER_FERNET = 'fernet'
+CIPHER_AES_GCM = 'aes-256-gcm'
+CIPHER_CHACHA20 = 'chacha20-poly1305'
+CIPHERS = (CIPHER_FERNET, CIPHER_AES_GCM, CIPHER_CHACHA20)
+DEFAULT_CIPHER = 'auto'
+_AEAD_CIPHERS = {CIPHER_AES_GCM: AESGCM, CIPHER_CHACHA20: ChaCha20Poly1305}
+_AEAD_KEY_SIZE = 32
+# nonce AEAD: случайный префикс файла и 8 байт номера фрагмента. Ключ данных
+# у каждого файла свой, поэтому пара (ключ, nonce) не повторяется
+_NONCE_PREFIX_SIZE = 4
+_NONCE_INDEX = struct.Struct('>Q')
+_LAST_CHUNK = b'\x01'
+_MIDDLE_CHUNK = b'\x00'
+
+# Сжатие перед шифрованием. Каждый фрагмент сжимается отдельно (чтобы
+# сохранить произвольный доступ) и начинается с байта-признака: 0 — данные
+# как есть, 1 — сжатые. Алгоритм записывается в поле заголовка 'compression'
+COMPRESSION_METHODS = ('zlib', 'lzma', 'zstd')
+# Размер начального образца, по которому решается, сжимать ли файл, и
+# минимальная экономия, ради которой стоит сжимать
+COMPRESSION_SAMPLE_SIZE = 256 * 1024
+COMPRESSION_MIN_SAVING = 0.1
+_RAW_CHUNK = b'\x00'
+_COMPRESSED_CHUNK = b'\x01'
+
+# Наблюдатели за фазами обработки (см. add_observer). Пока список пуст,
+# замеры времени не выполняются
+_observers = []
+
+# Число параллельных обработчиков по умолчанию: шифрование и ввод-вывод
+# хорошо перекрываются, поэтому берём по потоку на ядро
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Сколько фрагментов одного файла одновременно находится в общем пуле шифрования
+_CRYPTO_DEPTH = 4
+
+
+class EncryptedFileError(ValueError):
+    """Файл повреждён, обрезан или имеет неизвестный формат."""
+
+
+class WrongKeyError(EncryptedFileError):
+    """Файл зашифрован другим паролем или ключом."""
+
+
+class TruncatedFileError(EncryptedFileError):
+    """Файл обрезан: не хватает части заголовка или фрагментов."""
+
+
+class OperationCancelled(Exception):
+    """Операция прервана пользователем."""
+
+
+class JobSummary:
+    """Итоги обработки набора файлов: счётчики, объём и ошибки."""
+
+    def __init__(self):
+        self.files_total = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.files_skipped = 0
+        self.bytes_total = 0
+        self.bytes_processed = 0
+        self.cancelled = False
+        self.failures = []  # Пары (путь, сообщение об ошибке)
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return not self.failures
+
+    @property
+    def throughput(self):
+        """Измеренная скорость обработки, байт/с (0, если данных нет)."""
+        return self.bytes_processed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self):
+        """Возвращает итоги в виде словаря, пригодного для JSON."""
+        return {
+            'files_total': self.files_total,
+            'files_done': self.files_done,
+            'files_failed': self.files_failed,
+            'files_skipped': self.files_skipped,
+            'bytes_total': self.bytes_total,
+            'bytes_processed': self.bytes_processed,
+            'cancelled': self.cancelled,
+            'elapsed': round(self.elapsed, 3),
+            'failures': [{'path': path, 'error': error} for path, error in self.failures],
+        }
+
+
+class VerifySummary(JobSummary):
+    """Итоги проверки: кроме счётчиков, результат для каждого файла."""
+
+    def __init__(self):
+        super().__init__()
+        self.results = {}  # Путь -> (результат, сообщение об ошибке или None)
+
+    def counts(self):
+        """Число файлов с каждым результатом проверки."""
+        counts = collections.Counter(status for status, _ in self.results.values())
+        return dict(counts)
+
+    def to_dict(self):
+        """Итоги с числом файлов по результатам и списком проблемных файлов."""
+        result = super().to_dict()
+        result['statuses'] = self.counts()
+        result['files'] = [{'path': path, 'status': status, 'error': error}
+                           for path, (status, error) in sorted(self.results.items())
+                           if status not in (VERIFY_OK, VERIFY_NOT_ENCRYPTED)]
+        return result
+
+
+# Кэши мастер-ключей копий KeyChain по их идентификатору. Нужны, чтобы копии
+# в процессах-обработчиках не выводили ключ заново для каждого файла; сам
+# объект хранит кэш у себя, а запись реестра удаляется вместе с ним
+_master_caches = {}
+
+
+class KeyChain:
+    """Пароль и кэш выведенных из него мастер-ключей.
+
+    При шифровании используется одна случайная соль на объект (то есть на
+    задачу), при дешифровании — соль из заголовка каждого файла.
+    """
+
+    def __init__(self, password, iterations=KDF_ITERATIONS, kdf=None):
+        if isinstance(password, str):
+            password = password.encode()
+        # Изменяемая копия, чтобы close() мог затереть пароль в памяти
+        self._password = bytearray(password)
+        # Параметры KDF для новых файлов (см. calibrate_kdf); по умолчанию PBKDF2
+        self.kdf = _kdf_params(kdf or {'algorithm': KDF_PBKDF2, 'iterations': iterations})
+        self.salt = os.urandom(SALT_SIZE)
+        self._token = uuid.uuid4().hex
+        self._masters = {}
+        weakref.finalize(self, _master_caches.pop, self._token, None)
+        self._wrappers = {}  # Мастер-ключ -> готовый Fernet для обёртки ключей данных
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_masters'] = dict(self._masters)
+        state['_wrappers'] = {}
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._masters = _master_caches.setdefault(self._token, state['_masters'])
+        self._lock = threading.Lock()
+
+    def master_key(self, salt=None, params=None):
+        """Возвращает мастер-ключ для соли и параметров KDF (по умолчанию — этой задачи)."""
+        salt = self.salt if salt is None else salt
+        params = self.kdf if params is None else params
+        cache_key = (salt, tuple(sorted(params.items())))
+        with self._lock:
+            if cache_key not in self._masters:
+                self._masters[cache_key] = self._derive(salt, params)
+            return self._masters[cache_key]
+
+    def _derive(self, salt, params):
+        return derive_key(self._password, salt, params)
+
+    def wrapper(self, master):
+        """Возвращает Fernet мастер-ключа, создавая его один раз."""
+        with self._lock:
+            wrapper = self._wrappers.get(master)
+            if wrapper is None:
+                wrapper = self._wrappers[master] = Fernet(master)
+            return wrapper
+
+    def matches(self, password):
+        """Проверяет, что объект создан для этого пароля (за постоянное время)."""
+        if isinstance(password, str):
+            password = password.encode()
+        return hmac.compare_digest(bytes(self._password), password)
+
+    def kdf_params(self):
+        """Параметры KDF для записи в заголовок файла."""
+        return dict(self.kdf, salt=base64.b64encode(self.salt).decode())
+
+    def close(self):
+        """Затирает пароль и забывает выведенные ключи."""
+        with self._lock:
+            self._masters.clear()
+            self._wrappers.clear()
+            _master_caches.pop(self._token, None)
+            self._password[:] = bytes(len(self._password))
+            self._password = bytearray()
+
+
+class KeyRing(KeyChain):
+    """Мастер-ключи из файла ключа (см. save_key) вместо пароля.
+
+    Файл хранит мастер-ключ для каждой соли, с которой шифровались задачи,
+    поэтому дешифрует все их файлы; ключ выбирается по соли из заголовка.
+    Новые файлы шифруются последним сохранённым ключом с его солью.
+    """
+
+    def __init__(self, entries):
+        super().__init__(b'')
+        try:
+            for entry in entries:
+                salt = base64.b64decode(entry['kdf']['salt'], validate=True)
+                params = _kdf_params(entry['kdf'])
+                self._masters[(salt, tuple(sorted(params.items())))] = entry['key'].encode()
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValueError("Файл ключа повреждён.") from None
+        if not self._masters:
+            raise ValueError("Файл ключа пуст.")
+        self.salt, self.kdf = salt, params
+
+    def _derive(self, salt, params):
+        raise WrongKeyError("В файле ключа нет ключа для этого файла.")
+
+
+def add_observer(observer):
+    """Подключает наблюдателя за фазами обработки.
+
+    observer(event) получает словарь: phase ('kdf', 'read', 'encrypt',
+    'decrypt', 'write', 'fsync', 'rename' или 'file'), path, start и
+    duration (секунды time.perf_counter), bytes и thread. Вызывается в
+    потоке, выполнившем фазу; в режиме процессов события из дочерних
+    процессов не передаются. Base64 выполняется внутри Fernet и входит в
+    фазы 'encrypt' и 'decrypt'.
+    """
+    _observers.append(observer)
+
+def remove_observer(observer):
+    """Отключает наблюдателя."""
+    _observers.remove(observer)
+
+def _emit(phase, path, start, nbytes=0):
+    """Сообщает наблюдателям о фазе, начавшейся в момент start."""
+    event = {'phase': phase, 'path': path, 'start': start, 'duration': time.perf_counter() - start,
+             'bytes': nbytes, 'thread': threading.get_ident()}
+    for observer in tuple(_observers):
+        observer(event)
+
+def _trace_start():
+    """Момент начала фазы или None, если никто не наблюдает."""
+    return time.perf_counter() if _observers else None
+
+def _kdf_params(params):
+    """Проверяет параметры KDF и дополняет их алгоритмом по умолчанию."""
+    params = dict(params)
+    params.pop('salt', None)
+    algorithm = params.setdefault('algorithm', KDF_PBKDF2)
+    try:
+        if algorithm == KDF_PBKDF2:
+            valid = set(params) == {'algorithm', 'iterations'} and 0 < params['iterations'] <= KDF_MAX_ITERATIONS
+        elif algorithm == KDF_SCRYPT:
+            n, r, p = params['n'], params['r'], params['p']
+            valid = (set(params) == {'algorithm', 'n', 'r', 'p'} and 1 < n <= SCRYPT_MAX_N
+                     and not n & (n - 1) and 0 < r and 128 * n * r <= SCRYPT_MAX_MEMORY
+                     and 0 < p <= SCRYPT_MAX_P)
+        else:
+            valid = False
+    except (KeyError, TypeError):
+        valid = False
+    if not valid:
+        raise ValueError(f"Недопустимые параметры KDF: {params}")
+    return params
+
+def derive_key(password, salt, params):
+    """Выводит ключ из пароля по параметрам KDF ({'algorithm': ..., ...})."""
+    params = _kdf_params(params)
+    started = _trace_start()
+    if params['algorithm'] == KDF_SCRYPT:
+        kdf = Scrypt(salt=salt, length=32, n=params['n'], r=params['r'], p=params['p'])
+    else:
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=params['iterations'],
+        )
     key = base64.urlsafe_b64encode(kdf.derive(password))
+    if started is not None:
+        _emit('kdf', None, started)
     return key
 
+def generate_key(password, salt=_LEGACY_SALT, iterations=_LEGACY_ITERATIONS):
+    """Генерирует ключ на основе пароля (PBKDF2-SHA256)."""
+    return derive_key(password, salt, {'algorithm': KDF_PBKDF2, 'iterations': iterations})
+
+def _time_kdf(params, repeat=2):
+    """Лучшее время вывода ключа с параметрами params, секунды."""
+    salt = os.urandom(SALT_SIZE)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        derive_key(b'calibration', salt, params)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return max(best, 1e-6)
+
+def calibrate_kdf(target_seconds=KDF_TARGET_SECONDS, algorithm=KDF_PBKDF2):
+    """Подбирает параметры KDF, при которых вывод ключа занимает около target_seconds.
+
+    Возвращает словарь для KeyChain(password, kdf=...). Замеряется короткий
+    пробный вывод, а параметры масштабируются до нужного времени.
+    """
+    if algorithm == KDF_PBKDF2:
+        probe = 20000
+        elapsed = _time_kdf({'algorithm': KDF_PBKDF2, 'iterations': probe})
+        iterations = int(probe * target_seconds / elapsed) // 1000 * 1000
+        iterations = min(max(iterations, KDF_MIN_ITERATIONS), KDF_MAX_ITERATIONS)
+        return {'algorithm': KDF_PBKDF2, 'iterations': iterations}
+    if algorithm == KDF_SCRYPT:
+        params = {'algorithm': KDF_SCRYPT, 'n': SCRYPT_MIN_N, 'r': SCRYPT_R, 'p': SCRYPT_P}
+        elapsed = _time_kdf(params, repeat=1)
+        # Время scrypt растёт линейно с n, а n должно быть степенью двойки
+        while params['n'] < SCRYPT_MAX_N and elapsed * 2 <= target_seconds:
+            params['n'] *= 2
+            elapsed *= 2
+        return params
+    raise ValueError(f"Неизвестный алгоритм KDF: {algorithm}")
+
+def _key_file_entries(data):
+    """Записи файла ключа: [{'kdf': параметры с солью, 'key': мастер-ключ}]."""
+    try:
+        return json.loads(data)['keys']
+    except (ValueError, TypeError, KeyError):
+        pass
+    # Файл прежнего формата — ключ generate_key(пароль), то есть мастер-ключ
+    # для фиксированной соли файлов старого формата
+    try:
+        key = data.strip().decode('ascii')
+    except UnicodeDecodeError:
+        raise ValueError("Файл ключа повреждён.") from None
+    return [{'kdf': {'algorithm': KDF_PBKDF2, 'iterations': _LEGACY_ITERATIONS,
+                     'salt': base64.b64encode(_LEGACY_SALT).decode()}, 'key': key}]
+
 def save_key(key, key_file):
-    """Сохраняет ключ в файл."""
-    with open(key_file, 'wb') as f:
-        f.write(key)
+    """Добавляет мастер-ключ задачи (KeyChain) в файл ключа.
+
+    Мастер-ключ зависит от случайной соли задачи, поэтому файл хранит по
+    ключу на каждую соль: ключи прежних задач остаются, и файл дешифрует
+    файлы всех задач, ключ которых в него сохранён. Готовый ключ (bytes)
+    записывается как есть.
+    """
+    if not isinstance(key, KeyChain):
+        with open(key_file, 'wb') as f:
+            f.write(key)
+        return
+    entries = []
+    if os.path.exists(key_file):
+        with open(key_file, 'rb') as f:
+            entries = _key_file_entries(f.read())
+    entry = {'kdf': key.kdf_params(), 'key': key.master_key().decode()}
+    if entry not in entries:
+        entries.append(entry)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(key_file)), suffix=_TEMP_SUFFIX)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'keys': entries}, f, indent=1)
+        os.replace(tmp_path, key_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 def load_key(key_file):
-    """Загружает ключ из файла."""
+    """Загружает ключ из файла: KeyRing из save_key или ключ старого формата (bytes)."""
     if not os.path.exists(key_file):
         raise FileNotFoundError(f"Файл ключа '{key_file}' не найден.")
     with open(key_file, 'rb') as f:
-        return f.read()
-
-def encrypt_file(file_path, key):
-    """Шифрует файл с использованием указанного ключа."""
-    cipher_suite = Fernet(key)
-    with open(file_path, 'rb') as file:
-        file_data = file.read()
-    encrypted_data = cipher_suite.encrypt(file_data)
-    with open(file_path, 'wb') as file:
-        file.write(encrypted_data)
-
-def decrypt_file(file_path, key):
-    """Дешифрует файл с использованием указанного ключа."""
-    cipher_suite = Fernet(key)
-    with open(file_path, 'rb') as file:
-        encrypted_data = file.read()
-    decrypted_data = cipher_suite.decrypt(encrypted_data)
-    with open(file_path, 'wb') as file:
-        file.write(decrypted_data)
-
-def encrypt_directory(directory, key):
-    """Шифрует все файлы в указанной директории."""
-    for root, _, files in os.walk(directory):
+        data = f.read()
+    try:
+        entries = json.loads(data)['keys']
+    except (ValueError, TypeError, KeyError):
+        return data
+    return KeyRing(entries)
+
+def _valid_chunk_size(value):
+    return type(value) is int and 0 < value <= MAX_CHUNK_SIZE
+
+def _write_header(fout, fields, magic=MAGIC):
+    """Записывает заголовок и возвращает его хэш для привязки фрагментов."""
+    if not _valid_chunk_size(fields['chunk_size']):
+        raise ValueError(f"Недопустимый размер фрагмента: {fields['chunk_size']}.")
+    meta = json.dumps(fields, sort_keys=True, separators=(',', ':')).encode()
+    # Файлы с Fernet остаются версии 1, чтобы их читали и прежние версии программы
+    version = FORMAT_VERSION if 'cipher' in fields else _FERNET_FORMAT_VERSION
+    raw = magic + _HEADER_PREFIX.pack(version, len(meta)) + meta
+    fout.write(raw)
+    return hashlib.sha256(raw).digest()[:16]
+
+def _read_header(fin, magic=MAGIC):
+    """Читает заголовок потокового формата, возвращает (поля, хэш)."""
+    prefix = _read_full(fin, len(magic) + _HEADER_PREFIX.size)
+    if len(prefix) < len(magic) + _HEADER_PREFIX.size or not prefix.startswith(magic):
+        raise EncryptedFileError("Файл не является зашифрованным файлом StickNest.")
+    version, meta_len = _HEADER_PREFIX.unpack_from(prefix, len(magic))
+    if version not in (_FERNET_FORMAT_VERSION, FORMAT_VERSION):
+        raise EncryptedFileError(f"Неподдерживаемая версия формата: {version}.")
+    if meta_len > _MAX_HEADER_SIZE:
+        raise EncryptedFileError("Заголовок файла повреждён.")
+    meta = _read_full(fin, meta_len)
+    if len(meta) < meta_len:
+        raise TruncatedFileError("Файл обрезан: неполный заголовок.")
+    try:
+        fields = json.loads(meta)
+    except ValueError:
+        raise EncryptedFileError("Заголовок файла повреждён.") from None
+    # Поля заголовка используются до проверки подлинности фрагментов,
+    # поэтому их типы и пределы проверяются сразу
+    if (not isinstance(fields, dict) or not _valid_chunk_size(fields.get('chunk_size'))
+            or not isinstance(fields.get('wrapped_key', ''), str)
+            or not isinstance(fields.get('kdf', {}), dict)):
+        raise EncryptedFileError("Заголовок файла повреждён.")
+    return fields, hashlib.sha256(prefix + meta).digest()[:16]
+
+def _is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+def _new_data_key(key, cipher=CIPHER_FERNET):
+    """Создаёт ключ данных файла для шифра cipher и поля заголовка с его обёрткой."""
+    if isinstance(key, KeyChain):
+        master, fields = key.master_key(), {'kdf': key.kdf_params()}
+    else:
+        # Готовый ключ (например, из файла ключа) используется как мастер-ключ
+        master, fields = key, {}
+    if cipher == CIPHER_FERNET:
+        data_key = Fernet.generate_key()
+    else:
+        data_key = os.urandom(_AEAD_KEY_SIZE)
+        fields['cipher'] = cipher
+        fields['nonce'] = base64.b64encode(os.urandom(_NONCE_PREFIX_SIZE)).decode()
+    fields['wrapped_key'] = _key_wrapper(key, master).encrypt(data_key).decode()
+    return data_key, fields
+
+def _key_wrapper(key, master):
+    """Fernet мастер-ключа; у KeyChain он создаётся один раз на ключ."""
+    return key.wrapper(master) if isinstance(key, KeyChain) else Fernet(master)
+
+def _master_for(key, fields):
+    """Возвращает мастер-ключ для файла с указанным заголовком."""
+    if not isinstance(key, KeyChain):
+        return key
+    kdf = fields.get('kdf')
+    if kdf is None:
+        raise WrongKeyError("Файл зашифрован ключом из файла, а не паролем.")
+    try:
+        params = _kdf_params(kdf)
+    except ValueError as e:
+        raise EncryptedFileError(str(e)) from None
+    try:
+        salt = base64.b64decode(kdf['salt'], validate=True)
+    except (KeyError, TypeError, ValueError):
+        raise EncryptedFileError("Заголовок файла повреждён: нет соли KDF.") from None
+    return key.master_key(salt, params)
+
+def _data_key_for(key, fields):
+    """Разворачивает ключ данных файла из заголовка."""
+    master = _master_for(key, fields)
+    if 'wrapped_key' not in fields:
+        return master  # Ранние файлы потокового формата шифровались мастер-ключом
+    try:
+        return _key_wrapper(key, master).decrypt(fields['wrapped_key'].encode())
+    except InvalidToken:
+        # Обёртка ключа данных проверяется первой: её подпись не сходится
+        # только при неверном пароле или ключе
+        raise WrongKeyError("Неверный пароль или ключ.") from None
+
+def _legacy_key(key):
+    """Ключ для файлов старого формата (один Fernet-токен)."""
+    if isinstance(key, KeyChain):
+        return key.master_key(_LEGACY_SALT, {'algorithm': KDF_PBKDF2, 'iterations': _LEGACY_ITERATIONS})
+    return key
+
+def _legacy_cipher(key):
+    return _key_wrapper(key, _legacy_key(key))
+
+
+class _FernetFrames:
+    """Шифр фрагментов версии 1: кадр и данные внутри Fernet-токена."""
+
+    def __init__(self, data_key, digest):
+        self._fernet = Fernet(data_key)
+        self._digest = digest
+
+    def seal(self, index, last, payload):
+        return self._fernet.encrypt(_FRAME.pack(self._digest, index, last) + payload)
+
+    def open(self, token, index):
+        """Возвращает (последний ли фрагмент, данные); InvalidToken — подпись не сошлась."""
+        frame = self._fernet.decrypt(token)
+        frame_digest, frame_index, last = _FRAME.unpack_from(frame)
+        if frame_digest != self._digest or frame_index != index:
+            raise EncryptedFileError("Фрагменты файла подменены или переставлены.")
+        return last, memoryview(frame)[_FRAME.size:]
+
+
+class _AeadFrames:
+    """Шифр фрагментов версии 2: двоичный AEAD-токен, кадр — связанные данные.
+
+    Чужой номер или хэш заголовка не сходятся с тегом так же, как
+    повреждённые данные, поэтому обе ошибки видны как InvalidToken.
+    """
+
+    def __init__(self, cipher, data_key, digest, nonce_prefix):
+        self._aead = _AEAD_CIPHERS[cipher](data_key)
+        self._digest = digest
+        self._nonce_prefix = nonce_prefix
+
+    def seal(self, index, last, payload):
+        nonce = self._nonce_prefix + _NONCE_INDEX.pack(index)
+        flag = _LAST_CHUNK if last else _MIDDLE_CHUNK
+        return flag + self._aead.encrypt(nonce, payload, _FRAME.pack(self._digest, index, last))
+
+    def open(self, token, index):
+        """Возвращает (последний ли фрагмент, данные); InvalidToken — тег не сошёлся."""
+        flag = bytes(token[:1])
+        if flag not in (_LAST_CHUNK, _MIDDLE_CHUNK):
+            raise InvalidToken
+        last = flag == _LAST_CHUNK
+        nonce = self._nonce_prefix + _NONCE_INDEX.pack(index)
+        frame = _FRAME.pack(self._digest, index, last)
+        try:
+            payload = self._aead.decrypt(nonce, memoryview(token)[1:], frame)
+        except InvalidTag:
+            raise InvalidToken from None
+        return last, memoryview(payload)
+
+
+def _frame_cipher(fields, data_key, digest):
+    """Создаёт шифр фрагментов по полю заголовка 'cipher' (нет поля — Fernet)."""
+    cipher = fields.get('cipher', CIPHER_FERNET)
+    if cipher == CIPHER_FERNET:
+        return _FernetFrames(data_key, digest)
+    if cipher not in _AEAD_CIPHERS:
+        raise EncryptedFileError(f"Неизвестный шифр: {cipher}.")
+    try:
+        nonce_prefix = base64.b64decode(fields['nonce'])
+        if len(nonce_prefix) != _NONCE_PREFIX_SIZE:
+            raise ValueError
+        return _AeadFrames(cipher, data_key, digest, nonce_prefix)
+    except (KeyError, ValueError):
+        raise EncryptedFileError("Заголовок файла повреждён.") from None
+
+@functools.lru_cache(maxsize=None)
+def choose_cipher(sample_size=4 * CHUNK_SIZE):
+    """Выбирает самый быстрый AEAD-шифр на этой машине по короткому замеру.
+
+    Результат кэшируется на время работы процесса. Шифры, которых нет в
+    сборке OpenSSL, пропускаются; если недоступны оба, остаётся Fernet.
+    """
+    chunk = bytes(CHUNK_SIZE)
+    best = None
+    for cipher in (CIPHER_AES_GCM, CIPHER_CHACHA20):
+        try:
+            frames = _AeadFrames(cipher, os.urandom(_AEAD_KEY_SIZE), bytes(16), bytes(_NONCE_PREFIX_SIZE))
+            frames.seal(0, False, chunk)  # Разогрев
+        except UnsupportedAlgorithm:
+            continue
+        start = time.perf_counter()
+        for index in range(sample_size // CHUNK_SIZE):
+            frames.seal(index, False, chunk)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, cipher)
+    return CIPHER_FERNET if best is None else best[1]
+
+def _resolve_cipher(cipher):
+    """Проверяет параметр cipher; None и 'auto' — выбор по замеру."""
+    if cipher is None:
+        cipher = DEFAULT_CIPHER
+    if cipher == 'auto':
+        return choose_cipher()
+    if cipher not in CIPHERS:
+        raise ValueError(f"Неизвестный шифр: {cipher}.")
+    return cipher
+
+def _read_full(fin, size):
+    """Читает ровно size байт или меньше только в конце потока."""
+    data = fin.read(size)
+    if len(data) == size or not data:
+        return data
+    # Каналы и сокеты могут вернуть меньше запрошенного до конца потока
+    parts = [data]
+    remaining = size - len(data)
+    while remaining:
+        data = fin.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+_END = object()
+
+def _prefetch(iterable, depth=2):
+    """Выполняет итерацию в фоновом потоке, опережая потребителя на depth элементов.
+
+    Так чтение следующего блока с носителя идёт одновременно с шифрованием
+    текущего. Ошибки чтения передаются потребителю.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for item in iterable:
+                put(item)
+                if stop.is_set():
+                    return
+            put(_END)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def _iter_chunks(fin, chunk_size, buffer_size, read_ahead=True, path=None):
+    """Делит поток на фрагменты, читая его крупными блоками, кратными фрагменту."""
+    block_size = max(chunk_size, buffer_size // chunk_size * chunk_size)
+
+    def blocks():
+        while True:
+            started = _trace_start()
+            block = _read_full(fin, block_size)
+            if started is not None:
+                _emit('read', path, started, len(block))
+            yield block
+            if len(block) < block_size:
+                return
+
+    source = _prefetch(blocks()) if read_ahead else blocks()
+    try:
+        for block in source:
+            view = memoryview(block)
+            for offset in range(0, max(len(block), 1), chunk_size):
+                yield view[offset:offset + chunk_size]
+    finally:
+        source.close()
+
+def _iter_records(fin, path=None):
+    """Читает записи зашифрованных фрагментов (длина и токен)."""
+    while True:
+        started = _trace_start()
+        raw_len = _read_full(fin, _RECORD_LEN.size)
+        if not raw_len:
+            return
+        if len(raw_len) < _RECORD_LEN.size:
+            raise TruncatedFileError("Файл обрезан: неполный фрагмент.")
+        (token_len,) = _RECORD_LEN.unpack(raw_len)
+        token = _read_full(fin, token_len)
+        if len(token) < token_len:
+            raise TruncatedFileError("Файл обрезан: неполный фрагмент.")
+        if started is not None:
+            _emit('read', path, started, _RECORD_LEN.size + token_len)
+        yield token
+
+def _resolve_compression(compression):
+    """Выбирает алгоритм: 'auto' означает zstd, если он установлен, иначе zlib."""
+    if compression == 'auto':
+        return 'zstd' if zstandard is not None else 'zlib'
+    if compression not in (None,) + COMPRESSION_METHODS:
+        raise ValueError(f"Неизвестный алгоритм сжатия: {compression}")
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError("Для сжатия zstd требуется пакет zstandard.")
+    return compression
+
+def _worth_compressing(sample):
+    """Быстрая проверка образца: уже сжатые данные (JPEG, ZIP…) не сжимаются."""
+    sample = sample[:COMPRESSION_SAMPLE_SIZE]
+    if len(sample) < 512:
+        return False
+    return len(zlib.compress(sample, 1)) <= len(sample) * (1 - COMPRESSION_MIN_SAVING)
+
+def _compressor(method):
+    """Функция сжатия одного фрагмента."""
+    if method == 'zlib':
+        return lambda data: zlib.compress(data, 1)
+    if method == 'lzma':
+        return lambda data: lzma.compress(data, preset=1)
+    # Объекты zstandard нельзя использовать из нескольких потоков сразу
+    return lambda data: zstandard.ZstdCompressor(level=3).compress(data)
+
+def _decompressor(method, chunk_size):
+    """Функция распаковки одного фрагмента с ограничением размера результата."""
+    if method == 'zlib':
+        def decompress(data):
+            decompressor = zlib.decompressobj()
+            result = decompressor.decompress(data, chunk_size + 1)
+            if not decompressor.eof:
+                raise EncryptedFileError("Сжатый фрагмент повреждён.")
+            return result
+    elif method == 'lzma':
+        def decompress(data):
+            decompressor = lzma.LZMADecompressor()
+            result = decompressor.decompress(data, chunk_size + 1)
+            if not decompressor.eof:
+                raise EncryptedFileError("Сжатый фрагмент повреждён.")
+            return result
+    elif method == 'zstd':
+        if zstandard is None:
+            raise EncryptedFileError("Файл сжат zstd: установите пакет zstandard.")
+        def decompress(data):
+            return zstandard.ZstdDecompressor().decompress(data, max_output_size=chunk_size + 1)
+    else:
+        raise EncryptedFileError(f"Неизвестный алгоритм сжатия: {method}")
+    return decompress
+
+def _chunk_packer(method):
+    """Подготавливает фрагмент к шифрованию: сжимает, если это выгодно."""
+    if method is None:
+        return lambda chunk: chunk
+    compress = _compressor(method)
+
+    def pack(chunk):
+        compressed = compress(chunk)
+        if len(compressed) < len(chunk):
+            return _COMPRESSED_CHUNK + compressed
+        return _RAW_CHUNK + chunk
+    return pack
+
+def _chunk_unpacker(fields):
+    """Обратное преобразование для фрагментов файла с заголовком fields."""
+    method = fields.get('compression')
+    if method is None:
+        return lambda payload: payload
+    decompress = _decompressor(method, fields['chunk_size'])
+
+    def unpack(payload):
+        flag, data = payload[:1], payload[1:]
+        if flag == _RAW_CHUNK:
+            return data
+        if flag != _COMPRESSED_CHUNK:
+            raise EncryptedFileError("Неизвестный признак сжатия фрагмента.")
+        result = decompress(data)
+        if len(result) > fields['chunk_size']:
+            raise EncryptedFileError("Сжатый фрагмент повреждён.")
+        return result
+    return unpack
+
+def _crypto_map(func, items, crypto=None, depth=_CRYPTO_DEPTH):
+    """Применяет func к элементам, сохраняя порядок результатов.
+
+    С пулом crypto фрагменты шифруются в нём, опережая запись на depth
+    элементов; без пула — в текущем потоке.
+    """
+    if crypto is None:
+        for item in items:
+            yield func(item)
+        return
+    window = collections.deque()
+    try:
+        for item in items:
+            window.append(crypto.submit(func, item))
+            if len(window) >= depth:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+    finally:
+        for future in window:
+            future.cancel()
+
+def _checkpoint_every(chunk_size):
+    return max(1, CHECKPOINT_SIZE // chunk_size)
+
+def _encrypt_stream(fin, fout, key, chunk_size=CHUNK_SIZE, cancel_event=None,
+                    buffer_size=BUFFER_SIZE, read_ahead=True, path=None, compression=None,
+                    crypto=None, resume=None, checkpoint=None, cipher=None):
+    """Шифрует поток фрагментами фиксированного размера, при необходимости сжимая их.
+
+    cipher — шифр фрагментов из CIPHERS или 'auto' (по умолчанию).
+    resume — контрольная точка из журнала: fout тогда уже содержит заголовок
+    и первые фрагменты, и шифрование продолжается с места остановки.
+    checkpoint(fout, фрагментов, смещение_в_fin) вызывается каждые
+    CHECKPOINT_SIZE байт.
+    """
+    compression = _resolve_compression(compression)
+    cipher = _resolve_cipher(cipher)
+    if resume is not None:
+        fout.seek(0)
+        fields, digest = _read_header(fout)
+        chunk_size = fields['chunk_size']
+        fout.seek(resume['temp_offset'])
+        fout.truncate()
+        fin.seek(resume['source_offset'])
+    chunks = _iter_chunks(fin, chunk_size, buffer_size, read_ahead, path)
+    try:
+        chunk = next(chunks)
+        if resume is None:
+            # Решение о сжатии принимается по началу файла до записи заголовка
+            if compression is not None and not _worth_compressing(chunk):
+                compression = None
+            data_key, fields = _new_data_key(key, cipher)
+            fields['chunk_size'] = chunk_size
+            if compression is not None:
+                fields['compression'] = compression
+            digest = _write_header(fout, fields)
+        else:
+            data_key = _data_key_for(key, fields)
+        frames = _frame_cipher(fields, data_key, digest)
+        pack = _chunk_packer(fields.get('compression'))
+        every = _checkpoint_every(chunk_size)
+
+        def numbered(chunk):
+            index = 0 if resume is None else resume['chunks']
+            while True:
+                if _is_cancelled(cancel_event):
+                    raise OperationCancelled()
+                # Берём следующий фрагмент заранее, чтобы знать, последний ли текущий
+                next_chunk = next(chunks, None) if len(chunk) == chunk_size else None
+                last = next_chunk is None or not next_chunk
+                yield index, last, chunk
+                if last:
+                    return
+                chunk = next_chunk
+                index += 1
+
+        def seal(frame):
+            index, last, chunk = frame
+            started = _trace_start()
+            token = frames.seal(index, last, pack(chunk))
+            if started is not None:
+                _emit('encrypt', path, started, len(chunk))
+            return index, last, token
+
+        tokens = _crypto_map(seal, numbered(chunk), crypto)
+        try:
+            for index, last, token in tokens:
+                started = _trace_start()
+                fout.write(_RECORD_LEN.pack(len(token)))
+                fout.write(token)
+                if started is not None:
+                    _emit('write', path, started, _RECORD_LEN.size + len(token))
+                if checkpoint is not None and not last and (index + 1) % every == 0:
+                    checkpoint(fout, index + 1, (index + 1) * chunk_size)
+        finally:
+            tokens.close()
+    finally:
+        chunks.close()
+
+def _decrypt_stream(fin, fout, key, cancel_event=None, read_ahead=True, path=None, crypto=None,
+                    resume=None, checkpoint=None):
+    """Дешифрует поток, проверяя каждый фрагмент по отдельности.
+
+    resume и checkpoint — как у _encrypt_stream.
+    """
+    fields, digest = _read_header(fin)
+    frames = _frame_cipher(fields, _data_key_for(key, fields), digest)
+    unpack = _chunk_unpacker(fields)
+    first = 0
+    if resume is not None:
+        first = resume['chunks']
+        fin.seek(resume['source_offset'])
+        fout.seek(resume['temp_offset'])
+        fout.truncate()
+    # Смещение нужно только для контрольных точек: у каналов tell() недоступен
+    offset = fin.tell() if checkpoint is not None else 0
+    every = _checkpoint_every(fields['chunk_size'])
+    records = _prefetch(_iter_records(fin, path)) if read_ahead else _iter_records(fin, path)
+
+    def numbered():
+        for index, token in enumerate(records, first):
+            if _is_cancelled(cancel_event):
+                raise OperationCancelled()
+            yield index, token
+
+    def open_frame(record):
+        index, token = record
+        started = _trace_start()
+        try:
+            last, payload = frames.open(token, index)
+        except InvalidToken:
+            raise EncryptedFileError(f"Фрагмент {index} повреждён.") from None
+        if started is not None:
+            _emit('decrypt', path, started, len(token))
+        return index, last, unpack(payload), _RECORD_LEN.size + len(token)
+
+    chunks = _crypto_map(open_frame, numbered(), crypto)
+    try:
+        for index, last, chunk, record_size in chunks:
+            started = _trace_start()
+            fout.write(chunk)
+            if started is not None:
+                _emit('write', path, started, len(chunk))
+            offset += record_size
+            if checkpoint is not None and not last and (index + 1) % every == 0:
+                checkpoint(fout, index + 1, offset)
+            if last:
+                if next(chunks, None) is not None:
+                    raise EncryptedFileError("Лишние данные после последнего фрагмента.")
+                return
+        raise TruncatedFileError("Файл обрезан: отсутствует последний фрагмент.")
+    finally:
+        chunks.close()
+        records.close()
+
+def _fsync_directory(directory):
+    """Сбрасывает на диск запись каталога после переименования (где это возможно)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # Windows не позволяет открыть каталог
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+@contextlib.contextmanager
+def _atomic_output(dest_path, buffer_size=BUFFER_SIZE, mode_from=None, checkpoints=None):
+    """Открывает временный файл рядом с dest_path и атомарно ставит его на место.
+
+    Перед заменой временный файл сбрасывается на носитель, поэтому при сбое
+    или извлечении накопителя остаётся либо прежний файл, либо новый целиком.
+    С checkpoints временный файл может быть продолжен из журнала и не
+    удаляется при ошибке, если в журнале уже есть его контрольная точка.
+    """
+    directory = os.path.dirname(os.path.abspath(dest_path))
+    if checkpoints is not None and checkpoints.tmp_path is not None:
+        tmp_path = checkpoints.tmp_path
+        opened = open(tmp_path, 'r+b', buffering=buffer_size)
+    else:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix=_TEMP_SUFFIX)
+        opened = open(fd, 'wb', buffering=buffer_size)
+        if checkpoints is not None:
+            checkpoints.tmp_path = tmp_path
+    try:
+        with opened as fout:
+            yield fout
+            started = _trace_start()
+            fout.flush()
+            os.fsync(fout.fileno())
+            if started is not None:
+                _emit('fsync', dest_path, started)
+        if mode_from is not None:
+            try:
+                shutil.copymode(mode_from, tmp_path)
+            except OSError:
+                pass  # FAT/exFAT не хранят права доступа
+        started = _trace_start()
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if (checkpoints is None or not checkpoints.saved) and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_directory(directory)
+    if started is not None:
+        _emit('rename', dest_path, started)
+
+def _resolve_link(file_path):
+    """Путь файла, на который указывает ссылка: заменять нужно его, а не ссылку."""
+    return os.path.realpath(file_path) if os.path.islink(file_path) else file_path
+
+def _replace_with(file_path, transform, buffer_size=BUFFER_SIZE):
+    """Пишет результат во временный файл рядом и атомарно заменяет исходный."""
+    file_path = _resolve_link(file_path)
+    with _atomic_output(file_path, buffer_size, mode_from=file_path) as fout:
+        with open(file_path, 'rb', buffering=buffer_size) as fin:
+            # Фоновое чтение нужно только файлам длиннее одного блока
+            transform(fin, fout, os.fstat(fin.fileno()).st_size > buffer_size)
+
+
+class _Checkpoints:
+    """Контрольные точки одного файла в журнале задачи."""
+
+    def __init__(self, journal, file_path):
+        self.journal = journal
+        self.file_path = file_path
+        st = os.stat(file_path)
+        self.size, self.mtime_ns = st.st_size, st.st_mtime_ns
+        self.resume = None
+        self.tmp_path = None
+        record = journal.find_partial(file_path)
+        if record is not None:
+            tmp_path = journal.temp_path(file_path, record)
+            # Продолжать можно, только если исходный файл не менялся
+            if (record['size'] == self.size and record['mtime_ns'] == self.mtime_ns
+                    and os.path.exists(tmp_path) and os.path.getsize(tmp_path) >= record['temp_offset']):
+                self.resume, self.tmp_path = record, tmp_path
+            else:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                journal.discard(file_path)
+        self.saved = self.resume is not None
+
+    def __call__(self, fout, chunks, source_offset):
+        """Сбрасывает временный файл на носитель и отмечает точку в журнале."""
+        fout.flush()
+        os.fsync(fout.fileno())
+        self.journal.checkpoint(self.file_path, {
+            'temp': os.path.basename(self.tmp_path),
+            'temp_offset': fout.tell(),
+            'source_offset': source_offset,
+            'chunks': chunks,
+            'size': self.size,
+            'mtime_ns': self.mtime_ns,
+        })
+        self.saved = True
+
+def _replace_resumable(file_path, transform, buffer_size, journals):
+    """Как _replace_with, но крупный файл продолжается с контрольной точки журнала.
+
+    transform(fin, fout, read_ahead, resume, checkpoint).
+    """
+    file_path = _resolve_link(file_path)
+    journal = journals.find(file_path) if journals is not None else None
+    if journal is None:
+        return _replace_with(file_path, lambda fin, fout, read_ahead: transform(
+            fin, fout, read_ahead, None, None), buffer_size)
+    checkpoints = _Checkpoints(journal, file_path)
+    with _atomic_output(file_path, buffer_size, mode_from=file_path, checkpoints=checkpoints) as fout:
+        with open(file_path, 'rb', buffering=buffer_size) as fin:
+            transform(fin, fout, checkpoints.size > buffer_size, checkpoints.resume, checkpoints)
+
+def is_encrypted(file_path):
+    """Проверяет по сигнатуре, зашифрован ли файл в потоковом формате."""
+    with open(file_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def detect_format(file_path):
+    """Определяет формат по первым байтам: 'stream', 'container', 'legacy' или None."""
+    with open(file_path, 'rb') as f:
+        head = f.read(len(MAGIC))
+    if head == MAGIC:
+        return 'stream'
+    if head == CONTAINER_MAGIC:
+        return 'container'
+    if head.startswith(_LEGACY_PREFIX):
+        return 'legacy'
+    return None
+
+def encrypt_file(file_path, key, chunk_size=CHUNK_SIZE, cancel_event=None, buffer_size=BUFFER_SIZE,
+                 compression=None, crypto=None, journal=None, cipher=None):
+    """Шифрует файл с использованием указанного ключа.
+
+    compression ('auto', 'zlib', 'lzma' или 'zstd') включает сжатие перед
+    шифрованием для файлов, начало которых хорошо сжимается. cipher — шифр
+    фрагментов из CIPHERS; по умолчанию ('auto') выбирается более быстрый
+    AEAD-шифр на этой машине. Файлы с любым шифром дешифруются одинаково
+    по полю заголовка. crypto — общий пул потоков, в котором шифруются
+    фрагменты (см. process_files). С journal (JournalSet) крупный файл
+    отмечает контрольные точки и после сбоя продолжается с последней из них.
+    """
+    if os.stat(file_path).st_nlink > 1:
+        # Замена создаёт новый файл, и другие имена того же файла
+        # остались бы с открытым содержимым
+        raise ValueError("У файла несколько жёстких ссылок; зашифруйте его копию.")
+    started = _trace_start()
+    _replace_resumable(file_path, lambda fin, fout, read_ahead, resume, checkpoint: _encrypt_stream(
+        fin, fout, key, chunk_size, cancel_event, buffer_size, read_ahead, file_path, compression,
+        crypto, resume, checkpoint, cipher), buffer_size, journal)
+    if started is not None:
+        _emit('file', file_path, started, os.path.getsize(file_path))
+
+def decrypt_file(file_path, key, cancel_event=None, buffer_size=BUFFER_SIZE, crypto=None, journal=None):
+    """Дешифрует файл с использованием указанного ключа (journal — как у encrypt_file)."""
+    started = _trace_start()
+    if is_encrypted(file_path):
+        _replace_resumable(file_path, lambda fin, fout, read_ahead, resume, checkpoint: _decrypt_stream(
+            fin, fout, key, cancel_event, read_ahead, file_path, crypto, resume, checkpoint),
+            buffer_size, journal)
+    else:
+        # Старый формат: весь файл — один Fernet-токен
+        cipher_suite = _legacy_cipher(key)
+        _replace_with(file_path, lambda fin, fout, read_ahead: fout.write(cipher_suite.decrypt(fin.read())),
+                      buffer_size)
+    if started is not None:
+        _emit('file', file_path, started, os.path.getsize(file_path))
+
+def _copy_times(src_path, dest_path):
+    """Переносит время доступа и изменения исходного файла на результат."""
+    st = os.stat(src_path)
+    os.utime(dest_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+def encrypt_file_to(src_path, dest_path, key, chunk_size=CHUNK_SIZE, cancel_event=None,
+                    buffer_size=BUFFER_SIZE, compression=None, crypto=None, cipher=None):
+    """Шифрует src_path в dest_path, не изменяя исходный файл.
+
+    Время изменения переносится. При ошибке dest_path остаётся прежним.
+    """
+    started = _trace_start()
+    with _atomic_output(dest_path, buffer_size, mode_from=src_path) as fout:
+        with open(src_path, 'rb', buffering=buffer_size) as fin:
+            _encrypt_stream(fin, fout, key, chunk_size, cancel_event, buffer_size,
+                            os.fstat(fin.fileno()).st_size > buffer_size, src_path, compression, crypto,
+                            cipher=cipher)
+    _copy_times(src_path, dest_path)
+    if started is not None:
+        _emit('file', dest_path, started, os.path.getsize(dest_path))
+
+def decrypt_file_to(src_path, dest_path, key, cancel_event=None, buffer_size=BUFFER_SIZE, crypto=None):
+    """Дешифрует src_path в dest_path, не изменяя исходный файл (как encrypt_file_to)."""
+    started = _trace_start()
+    with _atomic_output(dest_path, buffer_size, mode_from=src_path) as fout:
+        with open(src_path, 'rb', buffering=buffer_size) as fin:
+            if fin.read(len(MAGIC)) == MAGIC:
+                fin.seek(0)
+                _decrypt_stream(fin, fout, key, cancel_event,
+                                os.fstat(fin.fileno()).st_size > buffer_size, src_path, crypto)
+            else:
+                fin.seek(0)
+                fout.write(_legacy_cipher(key).decrypt(fin.read()))
+    _copy_times(src_path, dest_path)
+    if started is not None:
+        _emit('file', dest_path, started, os.path.getsize(dest_path))
+
+def _copy_file(src_path, dest_path, buffer_size=BUFFER_SIZE):
+    """Копирует файл как есть с атомарной заменой и переносом времени изменения."""
+    with _atomic_output(dest_path, buffer_size, mode_from=src_path) as fout:
+        with open(src_path, 'rb', buffering=buffer_size) as fin:
+            shutil.copyfileobj(fin, fout, buffer_size)
+    _copy_times(src_path, dest_path)
+
+def encrypt_stream(fin, fout, key, chunk_size=CHUNK_SIZE, compression=None, cipher=None,
+                   workers=None, cancel_event=None, buffer_size=BUFFER_SIZE):
+    """Шифрует поток fin в поток fout: любые двоичные файловые объекты.
+
+    Подходит для каналов и сокетов (например, stdin и stdout): потоки не
+    перематываются, а в памяти одновременно находятся только блок чтения и
+    несколько фрагментов, какой бы длины ни был поток. Фрагменты шифруются
+    в пуле из workers потоков (1 — в вызывающем потоке). compression и
+    cipher — как у encrypt_file. Результат дешифруется decrypt_stream или,
+    если записан в файл, decrypt_file.
+    """
+    with _crypto_pool(workers) as crypto:
+        _encrypt_stream(fin, fout, key, chunk_size, cancel_event, buffer_size,
+                        compression=compression, crypto=crypto, cipher=cipher)
+
+def decrypt_stream(fin, fout, key, workers=None, cancel_event=None):
+    """Дешифрует поток fin, записанный encrypt_stream или encrypt_file, в fout.
+
+    Каждый фрагмент проверяется до записи, но при ошибке в середине потока
+    предыдущие фрагменты уже записаны в fout: окончательный результат —
+    только при успешном завершении. Файлы старого формата (один токен на
+    весь файл) этой функцией не читаются.
+    """
+    with _crypto_pool(workers) as crypto:
+        _decrypt_stream(fin, fout, key, cancel_event, crypto=crypto)
+
+@contextlib.contextmanager
+def _crypto_pool(workers=None):
+    """Пул для шифрования фрагментов одного потока или None для одного потока."""
+    workers = workers or DEFAULT_WORKERS
+    if workers == 1:
+        yield None
+        return
+    with ThreadPoolExecutor(max_workers=workers) as crypto:
+        yield crypto
+
+
+class EncryptedReader(io.RawIOBase):
+    """Зашифрованный файл как файловый объект только для чтения с seek/read.
+
+    Дешифруются только фрагменты, покрывающие запрошенный диапазон; последние
+    cache_size фрагментов хранятся в памяти (LRU). Открытые данные никогда не
+    записываются на носитель.
+    """
+
+    def __init__(self, file_path, key, cache_size=8):
+        super().__init__()
+        self.name = file_path
+        self._file = open(file_path, 'rb')
+        try:
+            fields, digest = _read_header(self._file)
+            self._frames = _frame_cipher(fields, _data_key_for(key, fields), digest)
+            self.chunk_size = fields['chunk_size']
+            self._unpack = _chunk_unpacker(fields)
+            self._offsets = self._index_records()
+            self._cache = collections.OrderedDict()
+            self._cache_size = max(1, cache_size)
+            last = self._chunk(len(self._offsets) - 1)
+        except BaseException:
+            self._file.close()
+            raise
+        self.size = (len(self._offsets) - 1) * self.chunk_size + len(last)
+        self._position = 0
+
+    def _index_records(self):
+        """Находит смещения записей, перескакивая по их длинам без дешифрования."""
+        offsets = []
+        position = self._file.tell()
+        end = os.fstat(self._file.fileno()).st_size
+        while position < end:
+            self._file.seek(position)
+            raw_len = self._file.read(_RECORD_LEN.size)
+            if len(raw_len) < _RECORD_LEN.size:
+                raise TruncatedFileError("Файл обрезан: неполный фрагмент.")
+            offsets.append(position)
+            position += _RECORD_LEN.size + _RECORD_LEN.unpack(raw_len)[0]
+        if position != end or not offsets:
+            raise TruncatedFileError("Файл обрезан: неполный фрагмент.")
+        return offsets
+
+    def _chunk(self, number):
+        """Возвращает открытые данные фрагмента, по возможности из кэша."""
+        chunk = self._cache.get(number)
+        if chunk is not None:
+            self._cache.move_to_end(number)
+            return chunk
+        self._file.seek(self._offsets[number])
+        (token_len,) = _RECORD_LEN.unpack(self._file.read(_RECORD_LEN.size))
+        try:
+            last, payload = self._frames.open(self._file.read(token_len), number)
+        except InvalidToken:
+            raise EncryptedFileError(f"Фрагмент {number} повреждён.") from None
+        if last != (number == len(self._offsets) - 1):
+            raise EncryptedFileError("Фрагменты файла подменены или переставлены.")
+        chunk = memoryview(self._unpack(payload))
+        self._cache[number] = chunk
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return chunk
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Недопустимое значение whence: {whence}")
+        if position < 0:
+            raise ValueError("Отрицательная позиция в файле.")
+        self._position = position
+        return position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        written = 0
+        while written < len(view) and self._position < self.size:
+            number, start = divmod(self._position, self.chunk_size)
+            piece = self._chunk(number)[start:start + len(view) - written]
+            view[written:written + len(piece)] = piece
+            written += len(piece)
+            self._position += len(piece)
+        return written
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+            self._cache.clear()
+        super().close()
+
+
+def open_encrypted(file_path, key, cache_size=8):
+    """Открывает зашифрованный файл для чтения произвольных диапазонов.
+
+    Файлы старого формата (один токен) целиком дешифруются в память.
+    """
+    if detect_format(file_path) == 'legacy':
+        with open(file_path, 'rb') as f:
+            return io.BytesIO(_legacy_cipher(key).decrypt(f.read()))
+    return EncryptedReader(file_path, key, cache_size)
+
+
+class _NullWriter:
+    """Приёмник, отбрасывающий записанные данные."""
+
+    def write(self, data):
+        return len(data)
+
+
+def _verify_legacy(token, key):
+    """Проверяет файл старого формата (один Fernet-токен)."""
+    try:
+        raw = base64.urlsafe_b64decode(token)
+    except ValueError:
+        raise EncryptedFileError("Файл повреждён.") from None
+    # Версия, время, IV и HMAC занимают 57 байт, шифротекст кратен блоку AES
+    if len(raw) < 57 + 16 or (len(raw) - 57) % 16:
+        raise TruncatedFileError("Файл обрезан.")
+    try:
+        _legacy_cipher(key).decrypt(token)
+    except InvalidToken:
+        # В старом формате подпись одна на весь файл, поэтому неверный ключ
+        # неотличим от повреждения; неверный ключ встречается чаще
+        raise WrongKeyError("Неверный пароль или ключ (или файл повреждён).") from None
+
+def verify_file(file_path, key, cancel_event=None, buffer_size=BUFFER_SIZE, crypto=None):
+    """Проверяет подписи всех фрагментов файла, ничего не записывая на диск."""
+    with open(file_path, 'rb', buffering=buffer_size) as fin:
+        magic = fin.read(len(MAGIC))
+        fin.seek(0)
+        if magic == MAGIC:
+            _decrypt_stream(fin, _NullWriter(), key, cancel_event,
+                            os.fstat(fin.fileno()).st_size > buffer_size, file_path, crypto)
+            return
+        if magic == CONTAINER_MAGIC:
+            with ContainerReader(file_path, key) as reader:
+                reader.verify(cancel_event)
+            return
+        _verify_legacy(fin.read(), key)
+
+def iter_files(path):
+    """Перебирает файлы по пути: сам файл или все файлы внутри директории."""
+    if os.path.isfile(path):
+        yield path
+        return
+    for root, _, files in os.walk(path):
         for file_name in files:
-            file_path = os.path.join(root, file_name)
-            encrypt_file(file_path, key)
+            if not is_reserved_name(file_name):
+                yield os.path.join(root, file_name)
+
+def _describe_error(error):
+    return str(error) or type(error).__name__
+
+# Результаты проверки файла (verify_paths)
+VERIFY_OK = 'ok'
+VERIFY_WRONG_KEY = 'wrong_key'
+VERIFY_CORRUPT = 'corrupt'
+VERIFY_TRUNCATED = 'truncated'
+VERIFY_NOT_ENCRYPTED = 'not_encrypted'
+VERIFY_UNREADABLE = 'unreadable'
+
+def verify_status(error):
+    """Результат проверки по исключению, которое выбросила verify_file."""
+    if error is None:
+        return VERIFY_OK
+    if isinstance(error, WrongKeyError):
+        return VERIFY_WRONG_KEY
+    if isinstance(error, TruncatedFileError):
+        return VERIFY_TRUNCATED
+    if isinstance(error, OSError):
+        return VERIFY_UNREADABLE
+    return VERIFY_CORRUPT
+
+
+# Запись плана: путь, размер, время изменения, устройство (st_dev) и формат
+# шифрования ('stream', 'legacy', 'container' или None для открытых файлов)
+PlanEntry = collections.namedtuple('PlanEntry', 'path size mtime_ns device encrypted')
+
+
+class JobPlan:
+    """Результат предварительного обхода: список файлов, объёмы и оценка времени."""
+
+    def __init__(self, entries, failures, directories=()):
+        self.entries = entries
+        self.failures = failures  # Пары (путь, сообщение об ошибке)
+        self.directories = list(directories)  # Обойдённые директории, включая пустые
+
+    @property
+    def files_total(self):
+        return len(self.entries)
+
+    @property
+    def bytes_total(self):
+        return sum(entry.size for entry in self.entries)
+
+    @property
+    def files_encrypted(self):
+        return sum(1 for entry in self.entries if entry.encrypted)
+
+    def pending(self, encrypted=False):
+        """Файлы, которые предстоит обработать: открытые или зашифрованные."""
+        return [entry for entry in self.entries if bool(entry.encrypted) == encrypted]
+
+    def devices(self):
+        """Объём работы по устройствам: {st_dev: (файлов, байт)}."""
+        totals = {}
+        for entry in self.entries:
+            files, size = totals.get(entry.device, (0, 0))
+            totals[entry.device] = (files + 1, size + entry.size)
+        return totals
+
+    def estimate_seconds(self, bytes_per_second=None, encrypted=False):
+        """Оценивает длительность задачи по измеренной скорости (байт/с)."""
+        if not bytes_per_second:
+            bytes_per_second = measure_throughput()
+        return sum(entry.size for entry in self.pending(encrypted)) / bytes_per_second
+
+    def to_dict(self, bytes_per_second=None):
+        """Сводка плана в виде словаря, пригодного для JSON."""
+        pending = self.pending()
+        return {
+            'files_total': self.files_total,
+            'bytes_total': self.bytes_total,
+            'files_encrypted': self.files_encrypted,
+            'files_pending': len(pending),
+            'bytes_pending': sum(entry.size for entry in pending),
+            'devices': {str(device): {'files': files, 'bytes': size}
+                        for device, (files, size) in self.devices().items()},
+            'estimated_seconds': round(self.estimate_seconds(bytes_per_second), 1),
+            'failures': [{'path': path, 'error': error} for path, error in self.failures],
+        }
+
+
+def is_reserved_name(name):
+    """Служебный файл StickNest (манифест, журнал, временный файл), который не шифруется."""
+    return name.endswith(_TEMP_SUFFIX) or name.startswith(RESERVED_PREFIX)
+
+def scan_paths(paths, manifests=None, detect=True):
+    """Быстро обходит пути через os.scandir и составляет план задачи.
+
+    Если файл не менялся с момента записи в манифест, он считается
+    зашифрованным без чтения; иначе (при detect=True) формат определяется
+    по первым байтам. Символическая ссылка на файл, который уже есть в
+    плане, пропускается; жёсткие ссылки — разные имена и остаются в плане.
+    """
+    entries = []
+    failures = []
+    directories = []
+    seen = set()  # (устройство, inode) файлов в плане
+    links = []  # Ссылки на файлы добавляются после обхода, если их цели нет в плане
+
+    def add(path, st):
+        # Для DirEntry на Windows inode неизвестен (0), там повторы не отсеиваются
+        if st.st_ino:
+            seen.add((st.st_dev, st.st_ino))
+        if manifests is not None and manifests.is_current(path, st.st_size, st.st_mtime_ns):
+            encrypted = 'stream'
+        else:
+            encrypted = detect_format(path) if detect else None
+        entries.append(PlanEntry(path, st.st_size, st.st_mtime_ns, st.st_dev, encrypted))
+
+    for path in paths:
+        try:
+            if not os.path.isdir(path):
+                if os.path.islink(path):
+                    links.append((path, os.stat(path)))
+                else:
+                    add(path, os.stat(path))
+                continue
+        except OSError as e:
+            failures.append((path, _describe_error(e)))
+            continue
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    directories.append(directory)
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file() and not is_reserved_name(entry.name):
+                                if entry.is_symlink():
+                                    links.append((entry.path, entry.stat()))
+                                else:
+                                    add(entry.path, entry.stat())
+                        except OSError as e:
+                            failures.append((entry.path, _describe_error(e)))
+            except OSError as e:
+                failures.append((directory, _describe_error(e)))
+    for path, st in links:
+        if (st.st_dev, st.st_ino) not in seen:
+            add(path, st)
+    return JobPlan(entries, failures, directories)
+
+@functools.lru_cache(maxsize=None)
+def measure_throughput(sample_size=4 * CHUNK_SIZE):
+    """Грубая оценка скорости шифрования на этой машине, байт/с.
+
+    Используется для оценки времени, пока нет замеров реальных задач.
+    """
+    cipher = choose_cipher()
+    if cipher == CIPHER_FERNET:
+        frames = _FernetFrames(Fernet.generate_key(), bytes(16))
+    else:
+        frames = _AeadFrames(cipher, os.urandom(_AEAD_KEY_SIZE), bytes(16), bytes(_NONCE_PREFIX_SIZE))
+    chunk = bytes(CHUNK_SIZE)
+    start = time.perf_counter()
+    for index in range(sample_size // CHUNK_SIZE):
+        frames.seal(index, False, chunk)
+    return sample_size / max(time.perf_counter() - start, 1e-6)
+
+def _plan_entry(path):
+    st = os.stat(path)
+    return PlanEntry(path, st.st_size, st.st_mtime_ns, st.st_dev, None)
+
+def process_files(func, files, key, workers=None, use_processes=False,
+                  progress=None, cancel_event=None, skip=None, summary=None, per_device=None,
+                  **file_options):
+    """Параллельно применяет func(путь, ключ) к файлам и собирает итоги.
+
+    files — JobPlan, записи PlanEntry или просто пути. Ошибка в отдельном
+    файле не прерывает задачу, а попадает в summary.failures; файлы, для
+    которых skip(запись) истинно, пропускаются. progress(summary, путь,
+    статус, ошибка) вызывается в вызывающем потоке; cancel_event
+    останавливает задачу. Остальные именованные параметры (например,
+    buffer_size) передаются в func.
+    """
+    summary = JobSummary() if summary is None else summary
+    start = time.perf_counter()
+    if isinstance(files, JobPlan):
+        summary.failures.extend(files.failures)
+        files = files.entries
+    queued = []
+    skipped = []
+    for item in files:
+        try:
+            entry = item if isinstance(item, PlanEntry) else _plan_entry(item)
+        except OSError as e:
+            summary.failures.append((item, _describe_error(e)))
+            continue
+        if skip is not None and skip(entry):
+            skipped.append(entry.path)
+        else:
+            queued.append(entry)
+    summary.files_total = len(queued) + len(skipped) + len(summary.failures)
+    summary.files_failed = len(summary.failures)
+    summary.bytes_total = sum(entry.size for entry in queued)
+    if progress is not None:
+        # 'started' (путь None) — итоговые объёмы известны; затем 'pending' для
+        # каждого файла в очереди, а после обработки — 'done', 'skipped' или 'failed'
+        progress(summary, None, 'started', None)
+        for entry in queued:
+            progress(summary, entry.path, 'pending', None)
+        for path, error in summary.failures:
+            progress(summary, path, 'failed', error)
+    for path in skipped:
+        summary.files_skipped += 1
+        if progress is not None:
+            progress(summary, path, 'skipped', None)
+
+    workers = workers or DEFAULT_WORKERS
+    # Крупные файлы запускаются первыми, чтобы в конце задачи не оставался
+    # один длинный файл на одном ядре; на одном носителе одновременно
+    # обрабатывается не больше per_device файлов (DEVICE_WORKERS, если
+    # носителей несколько)
+    scheduler = DeviceScheduler(queued)
+    if per_device is None and scheduler.devices > 1:
+        per_device = DEVICE_WORKERS
+    scheduler.limit = per_device
+    # Держим в очереди ограниченное число задач, чтобы не создавать
+    # десятки тысяч Future сразу и быстро реагировать на отмену
+    window = workers * 2
+    pool_size = workers
+    if not use_processes and cancel_event is not None:
+        # Отмена не запускает новые файлы, а в потоковом режиме прерывает текущие
+        # между фрагментами без порчи исходных. Событие нельзя передать в другой
+        # процесс, поэтому прерывание между фрагментами доступно только для потоков
+        file_options['cancel_event'] = cancel_event
+    with contextlib.ExitStack() as stack:
+        if per_device and not use_processes:
+            # Поток на каждый файл в работе занят вводом-выводом своего носителя,
+            # а фрагменты шифруются в общем пуле из workers потоков (параметр crypto)
+            pool_size = window = per_device * max(scheduler.devices, 1)
+            file_options['crypto'] = stack.enter_context(ThreadPoolExecutor(max_workers=workers))
+        if file_options:
+            func = functools.partial(func, **file_options)
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        executor = stack.enter_context(executor_class(max_workers=pool_size))
+        pending = {}
+        while True:
+            while len(pending) < window and not _is_cancelled(cancel_event):
+                entry = scheduler.next()
+                if entry is None:
+                    break
+                pending[executor.submit(func, entry.path, key)] = entry
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                entry = pending.pop(future)
+                scheduler.release(entry)
+                try:
+                    future.result()
+                except OperationCancelled:
+                    continue
+                except Exception as e:
+                    summary.files_failed += 1
+                    summary.failures.append((entry.path, _describe_error(e)))
+                    status, error = 'failed', e
+                else:
+                    summary.files_done += 1
+                    summary.bytes_processed += entry.size
+                    status, error = 'done', None
+                if progress is not None:
+                    progress(summary, entry.path, status, error)
+    summary.cancelled = _is_cancelled(cancel_event)
+    summary.elapsed = time.perf_counter() - start
+    return summary
+
+def _resume_plan(paths, journals, done_format, manifests=None):
+    """План продолжения задачи: файлы, готовые по журналу, не открываются.
+
+    Им присваивается формат done_format, остальным — формат по сигнатуре.
+    """
+    plan = scan_paths(paths, manifests, detect=False)
+    entries = []
+    for entry in plan.entries:
+        if journals.is_done(entry.path, entry.size, entry.mtime_ns):
+            entries.append(entry._replace(encrypted=done_format))
+        elif entry.encrypted is not None:
+            entries.append(entry)
+        else:
+            try:
+                entries.append(entry._replace(encrypted=detect_format(entry.path)))
+            except OSError as e:
+                plan.failures.append((entry.path, _describe_error(e)))
+    plan.entries = entries
+    return plan
+
+def _run_journaled(journals, action, run, options):
+    """Выполняет задачу с журналом; журнал завершённой задачи удаляется.
+
+    В режиме потоков журнал передаётся обработчикам файлов для
+    контрольных точек; процессам его передать нельзя, поэтому там журнал
+    отмечает только готовые файлы.
+    """
+    journals.open(action)
+    if not options.get('use_processes'):
+        options['journal'] = journals
+    summary = None
+    try:
+        summary = run()
+        return summary
+    finally:
+        journals.close(complete=summary is not None and not summary.cancelled)
+
+def encrypt_paths(paths, key, progress=None, plan=None, **options):
+    """Шифрует файлы и директории из списка путей как одну задачу.
+
+    Уже зашифрованные файлы и файлы, не изменившиеся с прошлого запуска
+    по манифесту директории, пропускаются. Готовый план (scan_paths)
+    можно передать, чтобы не обходить дерево повторно. Ход задачи пишется
+    в журнал на носителе; прерванная задача продолжается с места остановки.
+    """
+    manifests = ManifestSet(paths)
+    journals = JournalSet(paths)
+    if plan is None:
+        if journals.action == 'encrypt':
+            plan = _resume_plan(paths, journals, 'stream', manifests)
+        else:
+            plan = scan_paths(paths, manifests)
+
+    def skip(entry):
+        if not entry.encrypted:
+            return False
+        if not manifests.is_current(entry.path, entry.size, entry.mtime_ns):
+            manifests.record(entry.path, entry.size, entry.mtime_ns,
+                             0 if entry.encrypted == 'legacy' else FORMAT_VERSION)
+        return True
+
+    def on_progress(summary, path, status, error):
+        if status == 'done':
+            st = os.stat(path)
+            manifests.record(path, st.st_size, st.st_mtime_ns, FORMAT_VERSION)
+            journals.file_done(path, st.st_size, st.st_mtime_ns)
+        if progress is not None:
+            progress(summary, path, status, error)
+
+    try:
+        return _run_journaled(journals, 'encrypt', lambda: process_files(
+            encrypt_file, plan, key, progress=on_progress, skip=skip, **options), options)
+    finally:
+        manifests.save()
+
+def _not_decryptable(entry):
+    return entry.encrypted not in ('stream', 'legacy')
+
+def decrypt_paths(paths, key, progress=None, plan=None, **options):
+    """Дешифрует файлы и директории из списка путей как одну задачу.
+
+    Файлы без признаков шифрования пропускаются. Как и encrypt_paths,
+    ведёт журнал и продолжает прерванную задачу.
+    """
+    manifests = ManifestSet(paths)
+    journals = JournalSet(paths)
+    if plan is None:
+        if journals.action == 'decrypt':
+            plan = _resume_plan(paths, journals, None)
+        else:
+            plan = scan_paths(paths)
 
-def decrypt_directory(directory, key):
+    def on_progress(summary, path, status, error):
+        if status == 'done':
+            manifests.discard(path)
+            st = os.stat(path)
+            journals.file_done(path, st.st_size, st.st_mtime_ns)
+        if progress is not None:
+            progress(summary, path, status, error)
+
+    try:
+        return _run_journaled(journals, 'decrypt', lambda: process_files(
+            decrypt_file, plan, key, progress=on_progress, skip=_not_decryptable, **options), options)
+    finally:
+        manifests.save()
+
+def interrupted_action(paths):
+    """Задача ('encrypt' или 'decrypt'), прерванная на этих путях, или None."""
+    return JournalSet(paths).action
+
+def resume_paths(paths, key, progress=None, **options):
+    """Продолжает прерванную задачу по журналам на носителях.
+
+    Готовые файлы не открываются повторно, а крупные файлы продолжаются с
+    последней контрольной точки без повторного шифрования.
+    """
+    action = interrupted_action(paths)
+    if action is None:
+        raise ValueError("Нет прерванной задачи для продолжения.")
+    func = encrypt_paths if action == 'encrypt' else decrypt_paths
+    return func(paths, key, progress=progress, **options)
+
+def _not_encrypted(entry):
+    return entry.encrypted is None
+
+def verify_paths(paths, key, progress=None, plan=None, **options):
+    """Проверяет зашифрованные файлы и контейнеры, не записывая ничего на носитель.
+
+    Возвращает VerifySummary с результатом для каждого файла: ok,
+    wrong_key, corrupt, truncated, not_encrypted или unreadable.
+    """
+    if plan is None:
+        plan = scan_paths(paths)
+    summary = VerifySummary()
+
+    def on_progress(summary, path, status, error):
+        if status == 'skipped':
+            summary.results[path] = (VERIFY_NOT_ENCRYPTED, None)
+        elif status == 'done':
+            summary.results[path] = (VERIFY_OK, None)
+        elif status == 'failed':
+            if isinstance(error, str):  # Ошибка обхода: файл не удалось прочитать
+                summary.results[path] = (VERIFY_UNREADABLE, error)
+            else:
+                summary.results[path] = (verify_status(error), _describe_error(error))
+        if progress is not None:
+            progress(summary, path, status, error)
+
+    return process_files(verify_file, plan, key, progress=on_progress, skip=_not_encrypted,
+                         summary=summary, **options)
+
+def _tree_target(file_path, source, destination):
+    """Путь в дереве destination, соответствующий файлу из source."""
+    if os.path.isdir(source):
+        relative = os.path.relpath(file_path, source)
+    else:
+        relative = os.path.basename(file_path)
+    return os.path.join(destination, relative)
+
+def _is_within(path, directory):
+    """Проверяет, что path совпадает с directory или лежит внутри неё."""
+    path, directory = os.path.normcase(path), os.path.normcase(directory)
+    try:
+        return os.path.commonpath([path, directory]) == directory
+    except ValueError:
+        return False  # Разные диски Windows (C: и E:) не вложены друг в друга
+
+def _tree_plan(source, destination):
+    """План копирования: файлы source, сгруппированные по устройству назначения.
+
+    Узкое место при копировании — запись на носитель назначения, поэтому
+    планировщик считает все файлы относящимися к нему. Директории source,
+    включая пустые, сразу создаются в destination.
+    """
+    source, destination = os.path.abspath(source), os.path.abspath(destination)
+    if _is_within(destination, source):
+        raise ValueError("Папка назначения не может находиться внутри исходной.")
+    os.makedirs(destination, exist_ok=True)
+    plan = scan_paths([source], detect=False)
+    for directory in plan.directories:
+        try:
+            os.makedirs(_tree_target(directory, source, destination), exist_ok=True)
+        except OSError as e:
+            plan.failures.append((directory, _describe_error(e)))
+    device = os.stat(destination).st_dev
+    plan.entries = [entry._replace(device=device) for entry in plan.entries]
+    return plan
+
+def _encrypt_into(file_path, key, source, destination, buffer_size=BUFFER_SIZE, **options):
+    """Шифрует файл дерева source в дерево destination; зашифрованные копирует как есть."""
+    dest_path = _tree_target(file_path, source, destination)
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    if detect_format(file_path) is not None:
+        _copy_file(file_path, dest_path, buffer_size)
+    else:
+        encrypt_file_to(file_path, dest_path, key, buffer_size=buffer_size, **options)
+
+def _decrypt_into(file_path, key, source, destination, buffer_size=BUFFER_SIZE, **options):
+    """Дешифрует файл дерева source в дерево destination; открытые копирует как есть."""
+    dest_path = _tree_target(file_path, source, destination)
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    if detect_format(file_path) in ('stream', 'legacy'):
+        decrypt_file_to(file_path, dest_path, key, buffer_size=buffer_size, **options)
+    else:
+        _copy_file(file_path, dest_path, buffer_size)
+
+def encrypt_tree(source, destination, key, progress=None, **options):
+    """Шифрует файлы из source (например, с быстрого локального диска) в destination.
+
+    Каждый файл читается с источника и записывается на носитель один раз;
+    структура каталогов и время изменения файлов сохраняются, источник не
+    изменяется. Файлы, записанные прошлым запуском, пропускаются, если ни
+    они, ни их источники с тех пор не менялись (по манифесту назначения).
+    """
+    plan = _tree_plan(source, destination)
+    manifests = ManifestSet([destination])
+    # Состояние источников по плану: время изменения на FAT32/exFAT хранится
+    # грубее, поэтому сравнивать его с копией в назначении нельзя
+    sources = {entry.path: (entry.size, entry.mtime_ns) for entry in plan.entries}
+
+    def skip(entry):
+        dest_path = _tree_target(entry.path, source, destination)
+        try:
+            st = os.stat(dest_path)
+        except OSError:
+            return False
+        return (manifests.is_current(dest_path, st.st_size, st.st_mtime_ns)
+                and manifests.source_of(dest_path) == sources[entry.path])
+
+    def on_progress(summary, path, status, error):
+        if status == 'done':
+            dest_path = _tree_target(path, source, destination)
+            st = os.stat(dest_path)
+            manifests.record(dest_path, st.st_size, st.st_mtime_ns, FORMAT_VERSION, source=sources[path])
+        if progress is not None:
+            progress(summary, path, status, error)
+
+    try:
+        return process_files(_encrypt_into, plan, key, progress=on_progress, skip=skip,
+                             source=source, destination=destination, **options)
+    finally:
+        manifests.save()
+
+def decrypt_tree(source, destination, key, progress=None, **options):
+    """Дешифрует файлы из source в destination, не изменяя source (обратное encrypt_tree)."""
+    plan = _tree_plan(source, destination)
+    return process_files(_decrypt_into, plan, key, progress=progress,
+                         source=source, destination=destination, **options)
+
+def encrypt_directory(directory, key, workers=None, use_processes=False, **options):
+    """Шифрует все файлы в указанной директории."""
+    return encrypt_paths([directory], key, workers=workers, use_processes=use_processes, **options)
+
+def decrypt_directory(directory, key, workers=None, use_processes=False, **options):
     """Дешифрует все файлы в указанной директории."""
-    for root, _, files in os.walk(directory):
-        for file_name in files:
-            file_path = os.path.join(root, file_name)
-            decrypt_file(file_path, key)
\ No newline at end of file
+    return decrypt_paths([directory], key, workers=workers, use_processes=use_processes, **options)
+
+
+class _ChunkWriter:
+    """Склеивает поток в фрагменты фиксированного размера, шифрует и пишет их."""
+
+    def __init__(self, fout, frames, chunk_size):
+        self.fout = fout
+        self.frames = frames
+        self.chunk_size = chunk_size
+        self.position = 0  # Смещение в открытом потоке
+        self.offsets = []  # Смещения записей фрагментов в файле
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        self.position += len(data)
+        # Полный фрагмент остаётся в буфере, пока не станет ясно, последний ли он
+        while len(self._buffer) > self.chunk_size:
+            self._flush(bytes(self._buffer[:self.chunk_size]), False)
+            del self._buffer[:self.chunk_size]
+
+    def close(self):
+        self._flush(bytes(self._buffer), True)
+        self._buffer = bytearray()
+
+    def _flush(self, chunk, last):
+        token = self.frames.seal(len(self.offsets), last, chunk)
+        self.offsets.append(self.fout.tell())
+        self.fout.write(_RECORD_LEN.pack(len(token)))
+        self.fout.write(token)
+
+
+def pack_directory(directory, container_path, key, chunk_size=CHUNK_SIZE, buffer_size=BUFFER_SIZE,
+                   progress=None, cancel_event=None, remove_sources=False, cipher=None):
+    """Упаковывает дерево в один зашифрованный контейнер с индексом.
+
+    Вместо перезаписи каждого файла на носителе создаётся один файл, поэтому
+    операции с метаданными ФС и накладные расходы на каждый токен
+    не зависят от числа файлов. С remove_sources=True исходные файлы
+    удаляются после того, как контейнер записан на носитель. cipher — как
+    у encrypt_file.
+    """
+    cipher = _resolve_cipher(cipher)
+    summary = JobSummary()
+    start = time.perf_counter()
+    container_abs = os.path.abspath(container_path)
+    files = [path for path in iter_files(directory) if os.path.abspath(path) != container_abs]
+    summary.files_total = len(files)
+    entries = []
+    packed = []
+    try:
+        with _atomic_output(container_path, buffer_size) as fout:
+            data_key, fields = _new_data_key(key, cipher)
+            fields['chunk_size'] = chunk_size
+            digest = _write_header(fout, fields, CONTAINER_MAGIC)
+            frames = _frame_cipher(fields, data_key, digest)
+            writer = _ChunkWriter(fout, frames, chunk_size)
+            for path in files:
+                if _is_cancelled(cancel_event):
+                    raise OperationCancelled()
+                offset = writer.position
+                try:
+                    st = os.stat(path)
+                    with open(path, 'rb', buffering=buffer_size) as fin:
+                        for block in iter(lambda: fin.read(buffer_size), b''):
+                            writer.write(block)
+                except OSError as e:
+                    # Уже записанная часть файла остаётся в потоке без ссылки в индексе
+                    summary.files_failed += 1
+                    summary.failures.append((path, _describe_error(e)))
+                    status, error = 'failed', e
+                else:
+                    entries.append({'path': os.path.relpath(path, directory).replace(os.sep, '/'),
+                                    'offset': offset, 'length': writer.position - offset,
+                                    'mtime_ns': st.st_mtime_ns})
+                    packed.append(path)
+                    summary.files_done += 1
+                    summary.bytes_processed += writer.position - offset
+                    status, error = 'done', None
+                if progress is not None:
+                    progress(summary, path, status, error)
+            writer.close()
+            index = json.dumps({'files': entries, 'chunks': writer.offsets},
+                               separators=(',', ':')).encode()
+            index_token = frames.seal(_INDEX_FRAME, True, index)
+            index_offset = fout.tell()
+            fout.write(index_token)
+            fout.write(_TRAILER.pack(index_offset, len(index_token), CONTAINER_MAGIC))
+    except OperationCancelled:
+        # Временный файл контейнера уже удалён, исходные файлы не тронуты
+        summary.cancelled = True
+        summary.elapsed = time.perf_counter() - start
+        return summary
+    if remove_sources:
+        for path in packed:
+            os.remove(path)
+    summary.bytes_total = summary.bytes_processed
+    summary.elapsed = time.perf_counter() - start
+    return summary
+
+
+class ContainerReader:
+    """Произвольный доступ к контейнеру: список файлов и извлечение по одному.
+
+    Дешифруются только индекс и фрагменты, покрывающие нужный файл.
+    """
+
+    def __init__(self, container_path, key):
+        self._file = open(container_path, 'rb')
+        try:
+            fields, digest = _read_header(self._file, CONTAINER_MAGIC)
+            self._frames = _frame_cipher(fields, _data_key_for(key, fields), digest)
+            self.chunk_size = fields['chunk_size']
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() < _TRAILER.size:
+                raise TruncatedFileError("Контейнер обрезан.")
+            self._file.seek(-_TRAILER.size, os.SEEK_END)
+            index_offset, index_len, magic = _TRAILER.unpack(self._file.read(_TRAILER.size))
+            if magic != CONTAINER_MAGIC:
+                raise TruncatedFileError("Контейнер обрезан: нет индекса.")
+            self._file.seek(index_offset)
+            index = self._open_frame(self._file.read(index_len), _INDEX_FRAME, True)
+            index = json.loads(bytes(index))
+        except BaseException:
+            self._file.close()
+            raise
+        self._chunks = index['chunks']
+        self.entries = {entry['path']: entry for entry in index['files']}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _open_frame(self, token, index, last):
+        try:
+            frame_last, payload = self._frames.open(token, index)
+        except InvalidToken:
+            raise EncryptedFileError("Фрагмент контейнера повреждён.") from None
+        if frame_last != last:
+            raise EncryptedFileError("Фрагменты контейнера подменены или переставлены.")
+        return payload
+
+    def _read_chunk(self, number):
+        self._file.seek(self._chunks[number])
+        (token_len,) = _RECORD_LEN.unpack(self._file.read(_RECORD_LEN.size))
+        token = self._file.read(token_len)
+        if len(token) < token_len:
+            raise TruncatedFileError("Контейнер обрезан: неполный фрагмент.")
+        return self._open_frame(token, number, number == len(self._chunks) - 1)
+
+    def verify(self, cancel_event=None):
+        """Проверяет подписи всех фрагментов контейнера."""
+        for number in range(len(self._chunks)):
+            if _is_cancelled(cancel_event):
+                raise OperationCancelled()
+            self._read_chunk(number)
+
+    def list(self):
+        """Возвращает записи индекса: путь, смещение, длина и время изменения."""
+        return list(self.entries.values())
+
+    def iter_member(self, name):
+        """Перебирает открытые данные файла из контейнера частями."""
+        try:
+            entry = self.entries[name]
+        except KeyError:
+            raise KeyError(f"Файл '{name}' отсутствует в контейнере.") from None
+        position, end = entry['offset'], entry['offset'] + entry['length']
+        while position < end:
+            number, start = divmod(position, self.chunk_size)
+            chunk = self._read_chunk(number)
+            piece = chunk[start:start + end - position]
+            yield piece
+            position += len(piece)
+
+    def read(self, name):
+        """Возвращает открытые данные файла из контейнера целиком."""
+        return b''.join(self.iter_member(name))
+
+    def extract(self, name, dest_path, buffer_size=BUFFER_SIZE):
+        """Извлекает один файл в dest_path, восстанавливая время изменения."""
+        directory = os.path.dirname(os.path.abspath(dest_path))
+        os.makedirs(directory, exist_ok=True)
+        with _atomic_output(dest_path, buffer_size) as fout:
+            for piece in self.iter_member(name):
+                fout.write(piece)
+        mtime_ns = self.entries[name].get('mtime_ns')
+        if mtime_ns is not None:
+            os.utime(dest_path, ns=(mtime_ns, mtime_ns))
+
+
+def _member_path(directory, name):
+    """Путь для извлечения файла; имена, выходящие за пределы directory, отвергаются."""
+    parts = name.split('/')
+    if os.path.isabs(name) or '..' in parts or not all(parts):
+        raise EncryptedFileError(f"Недопустимое имя файла в контейнере: {name}")
+    return os.path.join(directory, *parts)
+
+def list_container(container_path, key):
+    """Возвращает список файлов контейнера, не дешифруя их содержимое."""
+    with ContainerReader(container_path, key) as reader:
+        return reader.list()
+
+def extract_file(container_path, key, name, dest_path):
+    """Извлекает из контейнера один файл."""
+    with ContainerReader(container_path, key) as reader:
+        reader.extract(name, dest_path)
+
+def unpack_container(container_path, key, directory, progress=None, cancel_event=None):
+    """Извлекает все файлы контейнера в directory."""
+    summary = JobSummary()
+    start = time.perf_counter()
+    with ContainerReader(container_path, key) as reader:
+        entries = reader.list()
+        summary.files_total = len(entries)
+        summary.bytes_total = sum(entry['length'] for entry in entries)
+        for entry in entries:
+            if _is_cancelled(cancel_event):
+                summary.cancelled = True
+                break
+            try:
+                reader.extract(entry['path'], _member_path(directory, entry['path']))
+            except (OSError, EncryptedFileError) as e:
+                summary.files_failed += 1
+                summary.failures.append((entry['path'], _describe_error(e)))
+                status, error = 'failed', e
+            else:
+                summary.files_done += 1
+                summary.bytes_processed += entry['length']
+                status, error = 'done', None
+            if progress is not None:
+                progress(summary, entry['path'], status, error)
+    summary.elapsed = time.perf_counter() - start
+    return summary
+
+
+class EncryptionSession:
+    """Разблокированный ключ для повторных операций без повторного вывода.
+
+    key — пароль (str), готовый KeyChain или ключ из файла ключа (bytes).
+    Мастер-ключ выводится один раз, при первом шифровании; он и подготовленный
+    объект обёртки ключей данных используются всеми операциями сессии, а
+    ключи файлов с другой солью выводятся один раз и кэшируются. options —
+    параметры по умолчанию для encrypt_many и decrypt_many (workers,
+    compression, cipher и т. д.). При выходе из with пароль затирается, а
+    выведенные ключи забываются.
+    """
+
+    _FORMAT_OPTIONS = ('chunk_size', 'compression', 'cipher')
+
+    def __init__(self, key, kdf=None, **options):
+        if isinstance(key, str):
+            key = KeyChain(key, kdf=kdf)
+        self.key = key
+        self.options = options
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def closed(self):
+        return self.key is None
+
+    def _key(self):
+        if self.key is None:
+            raise ValueError("Сессия шифрования закрыта.")
+        return self.key
+
+    def matches(self, password, kdf=None):
+        """Проверяет, что сессия открыта этим паролем (и, если kdf задан, с этими параметрами KDF)."""
+        if not isinstance(self.key, KeyChain):
+            return False
+        return self.key.matches(password) and (kdf is None or self.key.kdf == _kdf_params(kdf))
+
+    def master_key(self):
+        """Мастер-ключ сессии (для соли, с которой она шифрует файлы)."""
+        key = self._key()
+        return key.master_key() if isinstance(key, KeyChain) else key
+
+    def encrypt_many(self, paths, progress=None, **options):
+        """Шифрует файлы и директории как encrypt_paths; возвращает JobSummary."""
+        return encrypt_paths(paths, self._key(), progress, **dict(self.options, **options))
+
+    def decrypt_many(self, paths, progress=None, **options):
+        """Дешифрует файлы и директории как decrypt_paths; возвращает JobSummary."""
+        # Параметры формата нужны только при шифровании: при дешифровании они берутся из заголовков
+        defaults = {name: value for name, value in self.options.items() if name not in self._FORMAT_OPTIONS}
+        return decrypt_paths(paths, self._key(), progress, **dict(defaults, **options))
+
+    def encrypt_bytes(self, data, **options):
+        """Шифрует данные в памяти в тот же формат, что и файлы.
+
+        Учитываются параметры chunk_size, compression и cipher сессии или вызова.
+        """
+        options = dict(self.options, **options)
+        fout = io.BytesIO()
+        encrypt_stream(io.BytesIO(data), fout, self._key(), options.get('chunk_size', CHUNK_SIZE),
+                       options.get('compression'), options.get('cipher'), workers=1)
+        return fout.getvalue()
+
+    def decrypt_bytes(self, data):
+        """Дешифрует данные из encrypt_bytes или содержимое зашифрованного файла."""
+        key = self._key()
+        if data.startswith(_LEGACY_PREFIX):
+            try:
+                return _legacy_cipher(key).decrypt(data)
+            except InvalidToken:
+                raise WrongKeyError("Неверный пароль или ключ (или данные повреждены).") from None
+        fout = io.BytesIO()
+        decrypt_stream(io.BytesIO(data), fout, key, workers=1)
+        return fout.getvalue()
+
+    def close(self):
+        """Затирает пароль и забывает ключи; повторный вызов ничего не делает."""
+        if isinstance(self.key, KeyChain):
+            self.key.close()
+        self.key = None
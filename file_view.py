@@ -0,0 +1,121 @@
+# file_view.py
+
+import tkinter as tk
+from tkinter import ttk
+
+from languages import lang_manager
+
+# Сколько строк прокручивает одно деление колеса мыши
+WHEEL_STEP = 3
+
+
+class FileStatusView:
+    """Список файлов задачи и их состояний на основе ttk.Treeview.
+
+    Полный список файлов хранится в памяти, а в Treeview есть только
+    видимые строки (не больше rows): при прокрутке они заполняются заново.
+    Поэтому список остаётся отзывчивым и на сотнях тысяч файлов. Состояния
+    (pending, done, skipped, failed) применяются пакетами, и после каждого
+    пакета видимые строки перерисовываются один раз.
+    """
+
+    def __init__(self, parent, rows=12):
+        self.rows = rows
+        self.frame = tk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, columns=('status', 'reason'), height=rows, selectmode='none')
+        self.tree.heading('#0', text=lang_manager.get_text('column_file'))
+        self.tree.heading('status', text=lang_manager.get_text('column_status'))
+        self.tree.heading('reason', text=lang_manager.get_text('column_reason'))
+        self.tree.column('#0', width=320, stretch=True)
+        self.tree.column('status', width=90, stretch=False)
+        self.tree.column('reason', width=220, stretch=True)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient='vertical', command=self.scroll)
+        self.failed_only = tk.BooleanVar(value=False)
+        filter_check = tk.Checkbutton(self.frame, text=lang_manager.get_text('show_failed_only'),
+                                      variable=self.failed_only, command=self.apply_filter)
+
+        self.tree.grid(row=0, column=0, sticky='nsew')
+        self.scrollbar.grid(row=0, column=1, sticky='ns')
+        filter_check.grid(row=1, column=0, sticky='w')
+        self.frame.columnconfigure(0, weight=1)
+        self.frame.rowconfigure(0, weight=1)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(sequence, self.on_wheel)
+        self.clear()
+
+    def pack(self, **options):
+        self.frame.pack(**options)
+
+    def clear(self):
+        """Очищает список перед новой задачей."""
+        self._files = []  # Строки [путь, состояние, причина]
+        self._index = {}  # Путь -> номер строки
+        self._visible = None  # Номера строк под фильтром или None, если видны все
+        self._top = 0
+        self.refresh()
+
+    def apply_events(self, events):
+        """Применяет пакет событий (путь, состояние, причина) из BackgroundJob."""
+        if not events:
+            return
+        for path, status, reason in events:
+            number = self._index.get(path)
+            if number is None:
+                self._index[path] = len(self._files)
+                self._files.append([path, status, reason])
+            else:
+                row = self._files[number]
+                row[1], row[2] = status, reason
+        if self.failed_only.get():
+            self._filter()
+        self.refresh()
+
+    def _filter(self):
+        if self.failed_only.get():
+            self._visible = [number for number, row in enumerate(self._files) if row[1] == 'failed']
+        else:
+            self._visible = None
+
+    def apply_filter(self):
+        """Переключает показ только файлов с ошибками."""
+        self._filter()
+        self._top = 0
+        self.refresh()
+
+    def _count(self):
+        return len(self._files) if self._visible is None else len(self._visible)
+
+    def refresh(self):
+        """Заполняет строки Treeview данными видимой части списка."""
+        count = self._count()
+        self._top = max(0, min(self._top, count - self.rows))
+        shown = min(self.rows, count)
+        items = self.tree.get_children()
+        if len(items) > shown:
+            self.tree.delete(*items[shown:])
+        for _ in range(shown - len(items)):
+            self.tree.insert('', 'end')
+        for position, item in enumerate(self.tree.get_children()):
+            number = self._top + position
+            if self._visible is not None:
+                number = self._visible[number]
+            path, status, reason = self._files[number]
+            self.tree.item(item, text=path, values=(lang_manager.get_text('status_' + status), reason))
+        if count > self.rows:
+            self.scrollbar.set(self._top / count, (self._top + self.rows) / count)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll(self, action, value, unit=None):
+        """Команда полосы прокрутки: 'moveto' доля или 'scroll' число единиц/страниц."""
+        if action == 'moveto':
+            self._top = int(float(value) * self._count())
+        elif action == 'scroll':
+            self._top += int(value) * (self.rows if unit == 'pages' else 1)
+        self.refresh()
+
+    def on_wheel(self, event):
+        """Прокрутка колесом мыши (Windows и macOS — delta, X11 — кнопки 4 и 5)."""
+        direction = -1 if event.num == 4 or getattr(event, 'delta', 0) > 0 else 1
+        self.scroll('scroll', direction * WHEEL_STEP, 'units')
+        return 'break'
@@ -0,0 +1,90 @@
+# jobs.py
+
+import threading
+import time
+
+
+class BackgroundJob:
+    """Выполняет задачу шифрования в фоновом потоке и копит её прогресс.
+
+    target(progress, cancel_event) запускается в отдельном потоке и должен
+    вернуть JobSummary. Интерфейс периодически забирает сводку через
+    snapshot() и накопленные состояния файлов через take_events(), поэтому
+    частые события прогресса не нагружают главный поток.
+    """
+
+    def __init__(self, target, bytes_per_second=None):
+        self.target = target
+        # Скорость прошлых задач: по ней считается ETA, пока нет своих замеров
+        self.bytes_per_second = bytes_per_second
+        self.cancel_event = threading.Event()
+        self.result = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._counters = (0, 0, 0, 0)
+        self._events = []  # (путь, состояние, причина ошибки) с прошлого take_events
+        self._started_at = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Запускает задачу."""
+        self._started_at = time.perf_counter()
+        self._thread.start()
+
+    def cancel(self):
+        """Просит задачу остановиться между файлами или фрагментами."""
+        self.cancel_event.set()
+
+    @property
+    def done(self):
+        return self._started_at is not None and not self._thread.is_alive()
+
+    def _run(self):
+        try:
+            self.result = self.target(self._progress, self.cancel_event)
+        except Exception as e:
+            self.error = e
+
+    def _progress(self, summary, path, status, error):
+        """Принимает событие от движка шифрования (вызывается в фоновом потоке)."""
+        with self._lock:
+            files_done = summary.files_done + summary.files_failed + summary.files_skipped
+            self._counters = (files_done, summary.files_total,
+                              summary.bytes_processed, summary.bytes_total)
+            if path is not None:
+                reason = '' if error is None else (str(error) or type(error).__name__)
+                self._events.append((path, status, reason))
+
+    def take_events(self):
+        """Забирает состояния файлов, накопленные с прошлого вызова, одним пакетом."""
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+    def snapshot(self):
+        """Возвращает текущий прогресс: файлы, байты, скорость (МБ/с) и ETA (с)."""
+        with self._lock:
+            files_done, files_total, bytes_done, bytes_total = self._counters
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        speed = bytes_done / elapsed if elapsed > 0 else 0.0
+        rate = speed or self.bytes_per_second
+        eta = (bytes_total - bytes_done) / rate if rate else None
+        return {
+            'files_done': files_done,
+            'files_total': files_total,
+            'bytes_done': bytes_done,
+            'bytes_total': bytes_total,
+            'mb_per_s': speed / (1024 * 1024),
+            'eta': eta,
+        }
+
+
+def format_eta(seconds):
+    """Форматирует оставшееся время как ЧЧ:ММ:СС или ММ:СС."""
+    if seconds is None:
+        return '--:--'
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f'{hours}:{minutes:02d}:{secs:02d}'
+    return f'{minutes:02d}:{secs:02d}'
@@ -0,0 +1,172 @@
+# journal.py
+
+import json
+import os
+import threading
+
+from manifest import RESERVED_PREFIX
+
+JOURNAL_NAME = RESERVED_PREFIX + 'journal.jsonl'
+
+# Через сколько записей о готовых файлах сбрасывать журнал на носитель.
+# Потерянная запись не страшна: файл будет распознан по сигнатуре
+SYNC_EVERY = 64
+
+
+class Journal:
+    """Журнал задачи в корне носителя: готовые файлы и контрольные точки.
+
+    Записи дописываются в конец файла по одной JSON-строке, поэтому
+    прерванная запись портит только последнюю строку. Для крупных файлов
+    журнал хранит контрольные точки: сколько фрагментов уже записано во
+    временный файл, чтобы продолжить с этого места.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, JOURNAL_NAME)
+        self.action = None
+        self.done = {}  # Ключ файла -> (размер, время изменения) результата
+        self.partial = {}  # Ключ файла -> последняя контрольная точка
+        self._file = None
+        self._lock = threading.Lock()
+        self._unsynced = 0
+
+    @classmethod
+    def load(cls, root):
+        """Загружает журнал прерванной задачи; отсутствующий журнал — пустой."""
+        journal = cls(root)
+        try:
+            with open(journal.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # Строка оборвана сбоем: дальше данных нет
+                    journal._apply(record)
+        except OSError:
+            pass
+        return journal
+
+    def _apply(self, record):
+        op = record.get('op')
+        if op == 'begin':
+            self.action = record['action']
+        elif op == 'done':
+            self.done[record['path']] = (record['size'], record['mtime_ns'])
+            self.partial.pop(record['path'], None)
+        elif op == 'checkpoint':
+            self.partial[record['path']] = record
+        elif op == 'discard':
+            self.partial.pop(record['path'], None)
+
+    def _key(self, file_path):
+        return os.path.relpath(file_path, self.root).replace(os.sep, '/')
+
+    def temp_path(self, file_path, record):
+        """Полный путь временного файла из контрольной точки."""
+        return os.path.join(os.path.dirname(file_path), record['temp'])
+
+    def open(self, action):
+        """Начинает или продолжает задачу action ('encrypt' или 'decrypt').
+
+        Журнал другой задачи отбрасывается вместе с её временными файлами.
+        """
+        if self.action not in (None, action):
+            for key, record in self.partial.items():
+                temp_path = self.temp_path(os.path.join(self.root, *key.split('/')), record)
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            self.done, self.partial = {}, {}
+            os.remove(self.path)
+        resumed = self.action == action
+        self.action = action
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if not resumed:
+            self._write({'op': 'begin', 'action': action}, sync=True)
+
+    def _write(self, record, sync=False):
+        with self._lock:
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._file.flush()
+            self._unsynced += 1
+            if sync or self._unsynced >= SYNC_EVERY:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def is_done(self, file_path, size, mtime_ns):
+        """Проверяет, что файл уже обработан этой задачей и с тех пор не менялся."""
+        return self.done.get(self._key(file_path)) == (size, mtime_ns)
+
+    def find_partial(self, file_path):
+        """Последняя контрольная точка файла или None."""
+        return self.partial.get(self._key(file_path))
+
+    def file_done(self, file_path, size, mtime_ns):
+        """Отмечает файл обработанным (size и mtime_ns — у результата)."""
+        key = self._key(file_path)
+        self.done[key] = (size, mtime_ns)
+        self.partial.pop(key, None)
+        self._write({'op': 'done', 'path': key, 'size': size, 'mtime_ns': mtime_ns})
+
+    def checkpoint(self, file_path, record):
+        """Записывает контрольную точку крупного файла и сразу сбрасывает журнал."""
+        record = dict(record, op='checkpoint', path=self._key(file_path))
+        self.partial[record['path']] = record
+        self._write(record, sync=True)
+
+    def discard(self, file_path):
+        """Забывает контрольную точку файла (например, если исходный файл изменился)."""
+        if self.partial.pop(self._key(file_path), None) is not None:
+            self._write({'op': 'discard', 'path': self._key(file_path)})
+
+    def close(self, complete):
+        """Закрывает журнал; журнал завершённой задачи удаляется."""
+        if self._file is None:
+            return
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        if complete:
+            os.remove(self.path)
+
+
+class JournalSet:
+    """Журналы для набора путей: по одному на каждую выбранную директорию."""
+
+    def __init__(self, paths):
+        self.journals = [Journal.load(path) for path in paths if os.path.isdir(path)]
+
+    @property
+    def action(self):
+        """Задача, прерванная на этих носителях, или None."""
+        for journal in self.journals:
+            if journal.action is not None:
+                return journal.action
+        return None
+
+    def find(self, file_path):
+        """Возвращает журнал директории, в которой лежит файл, или None."""
+        for journal in self.journals:
+            if file_path.startswith(os.path.join(journal.root, '')):
+                return journal
+        return None
+
+    def open(self, action):
+        for journal in self.journals:
+            journal.open(action)
+
+    def is_done(self, file_path, size, mtime_ns):
+        journal = self.find(file_path)
+        return journal is not None and journal.is_done(file_path, size, mtime_ns)
+
+    def file_done(self, file_path, size, mtime_ns):
+        journal = self.find(file_path)
+        if journal is not None:
+            journal.file_done(file_path, size, mtime_ns)
+
+    def close(self, complete):
+        for journal in self.journals:
+            journal.close(complete)
@@ -1,6 +1,15 @@
 # main.py
 
-from ui import main
+import sys
+
+
+def main():
+    """Запускает консольный режим при наличии аргументов, иначе графический интерфейс."""
+    if len(sys.argv) > 1:
+        from cli import main as cli_main
+        return cli_main()
+    from ui import main as ui_main
+    return ui_main()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,127 @@
+# manifest.py
+
+import json
+import os
+import tempfile
+
+# Служебные файлы StickNest на носителе начинаются с этого префикса
+# и не обрабатываются при обходе директорий
+RESERVED_PREFIX = '.sticknest-'
+MANIFEST_NAME = RESERVED_PREFIX + 'manifest.json'
+
+# Как часто сбрасывать манифест на диск во время задачи (число изменений)
+SAVE_EVERY = 500
+
+
+class Manifest:
+    """Индекс зашифрованных файлов в корне носителя.
+
+    Для каждого файла хранит размер, время изменения и версию формата на
+    момент шифрования. Если файл с тех пор не менялся, повторный запуск
+    пропускает его, даже не открывая.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_NAME)
+        self.entries = {}
+        self._dirty = 0
+
+    @classmethod
+    def load(cls, root):
+        """Загружает манифест из корня; повреждённый манифест игнорируется."""
+        manifest = cls(root)
+        try:
+            with open(manifest.path, 'r', encoding='utf-8') as f:
+                manifest.entries = json.load(f).get('files', {})
+        except (OSError, ValueError, AttributeError):
+            manifest.entries = {}
+        return manifest
+
+    def _key(self, file_path):
+        return os.path.relpath(file_path, self.root).replace(os.sep, '/')
+
+    def is_current(self, file_path, size, mtime_ns):
+        """Проверяет, что файл не менялся с момента записи в манифест."""
+        entry = self.entries.get(self._key(file_path))
+        return entry is not None and entry['size'] == size and entry['mtime_ns'] == mtime_ns
+
+    def record(self, file_path, size, mtime_ns, version, source=None):
+        """Запоминает состояние зашифрованного файла.
+
+        source — (размер, время изменения) файла, из которого он записан
+        копированием из другого дерева (encrypt_tree).
+        """
+        entry = {'size': size, 'mtime_ns': mtime_ns, 'version': version}
+        if source is not None:
+            entry['source'] = list(source)
+        self.entries[self._key(file_path)] = entry
+        self._touch()
+
+    def source_of(self, file_path):
+        """Возвращает (размер, время изменения) источника копии или None."""
+        source = self.entries.get(self._key(file_path), {}).get('source')
+        return tuple(source) if source is not None else None
+
+    def discard(self, file_path):
+        """Удаляет файл из манифеста (например, после дешифрования)."""
+        if self.entries.pop(self._key(file_path), None) is not None:
+            self._touch()
+
+    def _touch(self):
+        self._dirty += 1
+        if self._dirty >= SAVE_EVERY:
+            self.save()
+
+    def save(self):
+        """Атомарно записывает манифест; пустой манифест удаляется."""
+        self._dirty = 0
+        if not self.entries:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=RESERVED_PREFIX)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'files': self.entries}, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class ManifestSet:
+    """Манифесты для набора путей: по одному на каждую выбранную директорию."""
+
+    def __init__(self, paths):
+        self.manifests = [Manifest.load(path) for path in paths if os.path.isdir(path)]
+
+    def find(self, file_path):
+        """Возвращает манифест директории, в которой лежит файл, или None."""
+        for manifest in self.manifests:
+            if file_path.startswith(os.path.join(manifest.root, '')):
+                return manifest
+        return None
+
+    def is_current(self, file_path, size, mtime_ns):
+        manifest = self.find(file_path)
+        return manifest is not None and manifest.is_current(file_path, size, mtime_ns)
+
+    def record(self, file_path, size, mtime_ns, version, source=None):
+        manifest = self.find(file_path)
+        if manifest is not None:
+            manifest.record(file_path, size, mtime_ns, version, source)
+
+    def source_of(self, file_path):
+        manifest = self.find(file_path)
+        return manifest.source_of(file_path) if manifest is not None else None
+
+    def discard(self, file_path):
+        manifest = self.find(file_path)
+        if manifest is not None:
+            manifest.discard(file_path)
+
+    def save(self):
+        for manifest in self.manifests:
+            manifest.save()
@@ -0,0 +1,49 @@
+# scheduler.py
+
+import collections
+
+# Сколько файлов одновременно читать и писать на одном носителе: флешки
+# быстро теряют скорость, если писать на них во много потоков сразу
+DEVICE_WORKERS = 2
+
+
+class DeviceScheduler:
+    """Очереди файлов по устройствам (st_dev) с ограничением параллельности.
+
+    Внутри устройства файлы выдаются от крупных к мелким. Следующий файл
+    берётся с наименее загруженного устройства, поэтому все носители
+    работают одновременно, а медленный не получает больше limit файлов сразу.
+    """
+
+    def __init__(self, entries, limit=None):
+        self.limit = limit
+        self._queues = {}
+        for entry in sorted(entries, key=lambda entry: entry.size, reverse=True):
+            self._queues.setdefault(entry.device, collections.deque()).append(entry)
+        self._active = collections.Counter()
+
+    @property
+    def devices(self):
+        return len(self._queues)
+
+    def next(self):
+        """Следующий файл для запуска или None, если свободных устройств нет."""
+        best = None
+        for device, entries in self._queues.items():
+            if not entries:
+                continue
+            active = self._active[device]
+            if self.limit is not None and active >= self.limit:
+                continue
+            rank = (active, -entries[0].size)
+            if best is None or rank < best[0]:
+                best = (rank, device)
+        if best is None:
+            return None
+        device = best[1]
+        self._active[device] += 1
+        return self._queues[device].popleft()
+
+    def release(self, entry):
+        """Отмечает, что файл устройства обработан и место освободилось."""
+        self._active[entry.device] -= 1
@@ -0,0 +1,75 @@
+# tracing.py
+"""Запись событий фаз шифрования и экспорт в формат Chrome Trace.
+
+Пример:
+    with TraceRecorder() as recorder:
+        encrypt_directory(path, key)
+    recorder.export_chrome('trace.json')  # открыть в chrome://tracing или Perfetto
+"""
+
+import json
+import os
+import threading
+
+import encryption
+
+
+class TraceRecorder:
+    """Наблюдатель, накапливающий события фаз обработки."""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def __enter__(self):
+        encryption.add_observer(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        encryption.remove_observer(self)
+
+    def totals(self):
+        """Суммарное время, число событий и байты по каждой фазе."""
+        totals = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            phase = totals.setdefault(event['phase'], {'count': 0, 'seconds': 0.0, 'bytes': 0})
+            phase['count'] += 1
+            phase['seconds'] += event['duration']
+            phase['bytes'] += event['bytes']
+        for phase in totals.values():
+            phase['seconds'] = round(phase['seconds'], 6)
+        return totals
+
+    def to_chrome(self):
+        """События в формате Chrome Trace Event (полные события 'X', время в мкс)."""
+        with self._lock:
+            events = list(self.events)
+        origin = min((event['start'] for event in events), default=0.0)
+        pid = os.getpid()
+        trace_events = []
+        for event in events:
+            args = {'bytes': event['bytes']}
+            if event['path']:
+                args['path'] = event['path']
+            trace_events.append({
+                'name': event['phase'],
+                'cat': 'sticknest',
+                'ph': 'X',
+                'ts': round((event['start'] - origin) * 1e6, 3),
+                'dur': round(event['duration'] * 1e6, 3),
+                'pid': pid,
+                'tid': event['thread'],
+                'args': args,
+            })
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome(self, trace_path):
+        """Записывает трассу в JSON-файл для chrome://tracing или Perfetto."""
+        with open(trace_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome(), f, ensure_ascii=False)
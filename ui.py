@@ -4,10 +4,14 @@
 
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from encryption import encrypt_directory, decrypt_directory, generate_key, save_key
+from encryption import EncryptionSession, calibrate_kdf, save_key
+from file_view import FileStatusView
+from jobs import BackgroundJob, format_eta
 from settings import KEY_FILE, DEFAULT_LANGUAGE, DEFAULT_THEME  # Импортируем DEFAULT_THEME
+import collections
 import json
 import os
+import threading
 
 try:
     import sv_ttk  # Попробуем использовать sv_ttk для более продвинутых тем
@@ -20,14 +24,19 @@ from languages import lang_manager
 # Файл для хранения пользовательских настроек (включая тему)
 SETTINGS_FILE = "app_settings.json"
 
+# Период обновления прогресса фоновой задачи, мс
+PROGRESS_INTERVAL_MS = 200
+
 class USBEncrypterApp:
     def __init__(self, root):
         self.root = root
-        self.root.title(lang_manager.get_text('main_title'))
 
         self.root.minsize(300, 200)
 
         self.user_settings = self.load_user_settings()
+        # Язык из настроек; каталог переводов загрузится при первом get_text
+        lang_manager.set_language(self.user_settings.get('language', DEFAULT_LANGUAGE))
+        self.root.title(lang_manager.get_text('main_title'))
         self.current_theme = self.user_settings.get('theme', DEFAULT_THEME)
         
         # Применяем тему
@@ -37,6 +46,13 @@ class USBEncrypterApp:
 
         self.center_window()
 
+        # Одна сессия шифрования на пароль: ключ выводится один раз и
+        # используется всеми задачами, пока пароль не сменится
+        self._session = None
+        self._session_users = collections.Counter()
+        self._session_lock = threading.Lock()
+        self._key_saved_for = None
+
     def center_window(self):
         """Центрирует окно приложения на экране."""
         # Обновляем "idle tasks" чтобы убедиться, что все геометрические параметры актуальны
@@ -132,7 +148,7 @@ class USBEncrypterApp:
         encrypt_window = tk.Toplevel(self.root)
         encrypt_window.title(lang_manager.get_text('encrypt_title'))
 
-        encrypt_window.minsize(400, 300)
+        encrypt_window.minsize(640, 560)
 
         self.center_toplevel_window(encrypt_window)
         
@@ -148,7 +164,8 @@ class USBEncrypterApp:
         encrypt_start_button = tk.Button(encrypt_window, text=lang_manager.get_text('start_encryption'),
                                        command=lambda: self.start_encryption(
                                            drive_entry.get().split(";"),
-                                           password_entry.get()))
+                                           password_entry.get(),
+                                           controls))
         
         # Размещаем элементы
         drive_label.pack(pady=10)
@@ -157,6 +174,7 @@ class USBEncrypterApp:
         password_label.pack(pady=15)
         password_entry.pack(pady=5)
         encrypt_start_button.pack(pady=20)
+        controls = self.create_progress_controls(encrypt_window, encrypt_start_button)
 
     def center_toplevel_window(self, window):
         """Центрирует дочернее окно (Toplevel) относительно главного окна."""
@@ -194,7 +212,7 @@ class USBEncrypterApp:
                 entry_widget.delete(0, tk.END)
                 entry_widget.insert(0, folder)
     
-    def start_encryption(self, paths, password):
+    def start_encryption(self, paths, password, controls=None):
         """Запускает процесс шифрования."""
         if not paths or (len(paths) == 1 and not paths[0]):
             messagebox.showerror("Ошибка", lang_manager.get_text('error_select_files'))
@@ -204,23 +222,80 @@ class USBEncrypterApp:
             messagebox.showerror("Ошибка", lang_manager.get_text('error_enter_password'))
             return
         
-        try:
-            key = generate_key(password.encode())
-            save_key(key, KEY_FILE)
-            
-            for path in paths:
-                if path:  # Проверяем, что путь не пустой
-                    encrypt_directory(path, key)
-            messagebox.showinfo("Успех", lang_manager.get_text('success_encryption'))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"{lang_manager.get_text('error_encryption')} {str(e)}")
+        paths = [path for path in paths if path]  # Отбрасываем пустые пути
+        kdf = self.user_settings.get('kdf')
+        calibrated = {}
+
+        def target(progress, cancel_event):
+            params = kdf
+            if params is None:
+                # Параметры KDF подбираются под эту машину один раз; в настройки
+                # их записывает poll_job в главном потоке
+                params = calibrated['kdf'] = calibrate_kdf()
+            session = self.acquire_session(password, params)
+            try:
+                with self._session_lock:
+                    # Ключ сессии добавляется в файл ключа (к ключам прежних сессий) один раз
+                    if self._key_saved_for is not session:
+                        save_key(session.key, KEY_FILE)
+                        self._key_saved_for = session
+                return session.encrypt_many(paths, progress=progress, cancel_event=cancel_event)
+            finally:
+                self.release_session(session)
+
+        self.run_job(target, controls, 'success_encryption', 'error_encryption',
+                     on_done=lambda: self.remember_kdf(calibrated.get('kdf')))
     
+    def remember_kdf(self, kdf):
+        """Сохраняет в настройках параметры KDF, подобранные фоновой задачей."""
+        if kdf is not None:
+            self.user_settings['kdf'] = kdf
+            self.save_user_settings()
+
+    def acquire_session(self, password, kdf=None):
+        """Возвращает сессию для пароля (вызывается в фоновом потоке задачи).
+
+        Новая сессия создаётся, только если сменился пароль или (для
+        шифрования, kdf задан) параметры KDF; прежняя закрывается, когда
+        её перестанут использовать все задачи.
+        """
+        with self._session_lock:
+            if self._session is None or not self._session.matches(password, kdf):
+                previous, self._session = self._session, EncryptionSession(password, kdf=kdf)
+                if previous is not None and not self._session_users[previous]:
+                    previous.close()
+            self._session_users[self._session] += 1
+            return self._session
+
+    def release_session(self, session):
+        """Отмечает, что задача закончила работу с сессией."""
+        with self._session_lock:
+            self._session_users[session] -= 1
+            if not self._session_users[session]:
+                del self._session_users[session]
+                if session is not self._session:
+                    session.close()
+
+    def close_session(self):
+        """Затирает ключи текущей сессии (при выходе из программы)."""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def format_failures(self, failures, limit=5):
+        """Формирует краткий список файлов, которые не удалось обработать."""
+        lines = [f"{path}: {error}" for path, error in failures[:limit]]
+        if len(failures) > limit:
+            lines.append(f"... (+{len(failures) - limit})")
+        return "\n" + "\n".join(lines)
+
     def show_decrypt_window(self):
         """Открывает окно дешифрования."""
         decrypt_window = tk.Toplevel(self.root)
         decrypt_window.title(lang_manager.get_text('decrypt_title'))
 
-        decrypt_window.minsize(400, 300)
+        decrypt_window.minsize(640, 560)
 
         self.center_toplevel_window(decrypt_window)
         
@@ -236,7 +311,8 @@ class USBEncrypterApp:
         decrypt_start_button = tk.Button(decrypt_window, text=lang_manager.get_text('start_decryption'),
                                        command=lambda: self.start_decryption(
                                            decrypt_entry.get().split(";"),
-                                           decrypt_password_entry.get()))
+                                           decrypt_password_entry.get(),
+                                           controls))
         
         # Размещаем элементы
         decrypt_label.pack(pady=10)
@@ -245,6 +321,7 @@ class USBEncrypterApp:
         decrypt_password_label.pack(pady=15)
         decrypt_password_entry.pack(pady=5)
         decrypt_start_button.pack(pady=20)
+        controls = self.create_progress_controls(decrypt_window, decrypt_start_button)
     
     def browse_files_or_folders(self, entry_widget, parent_window):
         """Открывает диалоговое окно для выбора файлов/папок с управлением видимостью родительского окна."""
@@ -274,7 +351,7 @@ class USBEncrypterApp:
             entry_widget.delete(0, tk.END)
             entry_widget.insert(0, ";".join(selected_paths))
     
-    def start_decryption(self, paths, password):
+    def start_decryption(self, paths, password, controls=None):
         """Запускает процесс дешифрования."""
         if not paths or (len(paths) == 1 and not paths[0]):
             messagebox.showerror("Ошибка", lang_manager.get_text('error_select_encrypted_files'))
@@ -284,14 +361,95 @@ class USBEncrypterApp:
             messagebox.showerror("Ошибка", lang_manager.get_text('error_enter_password'))
             return
         
-        try:
-            key = generate_key(password.encode())
-            for path in paths:
-                if path:  # Проверяем, что путь не пустой
-                    decrypt_directory(path, key)
-            messagebox.showinfo("Успех", lang_manager.get_text('success_decryption'))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"{lang_manager.get_text('error_decryption')} {str(e)}")
+        paths = [path for path in paths if path]  # Отбрасываем пустые пути
+
+        def target(progress, cancel_event):
+            session = self.acquire_session(password)
+            try:
+                return session.decrypt_many(paths, progress=progress, cancel_event=cancel_event)
+            finally:
+                self.release_session(session)
+
+        self.run_job(target, controls, 'success_decryption', 'error_decryption')
+    
+    def create_progress_controls(self, window, start_button):
+        """Добавляет в окно индикатор прогресса, строку состояния, кнопку отмены и список файлов."""
+        progress_bar = ttk.Progressbar(window, length=300, maximum=100)
+        status_label = tk.Label(window, text="")
+        cancel_button = tk.Button(window, text=lang_manager.get_text('cancel_button'), state='disabled')
+        files_view = FileStatusView(window)
+        progress_bar.pack(pady=5)
+        status_label.pack(pady=5)
+        cancel_button.pack(pady=10)
+        files_view.pack(fill='both', expand=True, padx=10, pady=5)
+        return {'window': window, 'start': start_button, 'bar': progress_bar,
+                'status': status_label, 'cancel': cancel_button, 'files': files_view}
+
+    def run_job(self, target, controls, success_key, error_key, on_done=None):
+        """Запускает задачу в фоновом потоке и следит за ней через root.after.
+
+        on_done() вызывается в главном потоке после завершения задачи.
+        """
+        job = BackgroundJob(target, self.user_settings.get('throughput'))
+        if controls:
+            controls['files'].clear()
+            controls['start'].config(state='disabled')
+            controls['cancel'].config(state='normal', command=job.cancel)
+            # Закрытие окна во время работы отменяет задачу
+            controls['window'].protocol("WM_DELETE_WINDOW",
+                                        lambda: (job.cancel(), controls['window'].destroy()))
+        job.start()
+        self.root.after(PROGRESS_INTERVAL_MS, self.poll_job, job, controls, success_key, error_key, on_done)
+
+    def poll_job(self, job, controls, success_key, error_key, on_done=None):
+        """Обновляет прогресс фоновой задачи и показывает итог по её завершении."""
+        visible = bool(controls) and controls['window'].winfo_exists()
+        # События забираются всегда, чтобы они не копились при закрытом окне
+        events = job.take_events()
+        if visible:
+            self.show_progress(job.snapshot(), controls)
+            controls['files'].apply_events(events)
+        if not job.done:
+            self.root.after(PROGRESS_INTERVAL_MS, self.poll_job, job, controls, success_key, error_key, on_done)
+            return
+        if on_done is not None:
+            on_done()
+        
+        if visible:
+            controls['start'].config(state='normal')
+            controls['cancel'].config(state='disabled')
+        
+        if job.error is not None:
+            messagebox.showerror("Ошибка", f"{lang_manager.get_text(error_key)} {str(job.error)}")
+        elif job.result.cancelled:
+            messagebox.showinfo("Отмена", lang_manager.get_text('job_cancelled'))
+        elif job.result.failures and visible:
+            # Причины по каждому файлу видны в списке окна
+            messagebox.showerror("Ошибка", f"{lang_manager.get_text(error_key)} "
+                                 f"{lang_manager.get_text('failures_summary').format(count=len(job.result.failures))}")
+        elif job.result.failures:
+            messagebox.showerror("Ошибка", f"{lang_manager.get_text(error_key)} {self.format_failures(job.result.failures)}")
+        else:
+            messagebox.showinfo("Успех", lang_manager.get_text(success_key))
+        
+        # Запоминаем скорость для оценки времени следующих задач
+        if job.result is not None and job.result.bytes_processed and job.result.throughput:
+            self.user_settings['throughput'] = round(job.result.throughput)
+            self.save_user_settings()
+
+    def show_progress(self, snapshot, controls):
+        """Отображает прогресс: файлы, мегабайты, скорость и оставшееся время."""
+        if snapshot['bytes_total']:
+            controls['bar']['value'] = 100 * snapshot['bytes_done'] / snapshot['bytes_total']
+        elif snapshot['files_total']:
+            controls['bar']['value'] = 100 * snapshot['files_done'] / snapshot['files_total']
+        controls['status'].config(text=lang_manager.get_text('progress_status').format(
+            files_done=snapshot['files_done'],
+            files_total=snapshot['files_total'],
+            mb_done=snapshot['bytes_done'] / (1024 * 1024),
+            mb_total=snapshot['bytes_total'] / (1024 * 1024),
+            speed=snapshot['mb_per_s'],
+            eta=format_eta(snapshot['eta'])))
     
     def show_settings(self):
         """Показывает диалоговое окно настроек."""
@@ -401,6 +559,7 @@ def main():
         pass
     
     root.mainloop()
+    app.close_session()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
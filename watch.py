@@ -0,0 +1,306 @@
+# watch.py
+"""Наблюдение за носителем: новые и изменённые файлы шифруются пакетами.
+
+Изменения берутся из inotify (Linux, через ctypes без сторонних пакетов),
+а где его нет — из периодического обхода дерева со сравнением размера и
+времени изменения. Файлы копятся, пока в дереве не наступит затишье, и
+шифруются одной задачей encrypt_paths уже разблокированным ключом.
+
+Пример:
+    with Watcher('/media/usb', key) as watcher:
+        watcher.run(on_batch=lambda summary: print(summary.to_dict()))
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import stat
+import struct
+import time
+
+import encryption
+from manifest import ManifestSet
+
+# Сколько секунд в дереве не должно быть событий, чтобы запустить пакет
+QUIET_SECONDS = 2.0
+# Файл считается дописанным, если его размер и время изменения не менялись
+# столько секунд (по двум проверкам, без опоры на часы носителя)
+STABLE_SECONDS = 1.0
+# Период обхода дерева без inotify
+POLL_INTERVAL = 5.0
+# Как часто проверять stop_event и наличие носителя
+_TICK = 1.0
+
+# Константы inotify из <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_ONLYDIR
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, длина имени
+_READ_SIZE = 64 * 1024
+
+
+def _walk_dirs(root):
+    """Перебирает директорию и все вложенные в неё (без перехода по ссылкам)."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        yield directory
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+        except OSError:
+            continue
+
+
+class InotifySource:
+    """Изменения дерева через inotify: между событиями дерево не обходится.
+
+    На каждую директорию ставится отдельное наблюдение; для новых директорий
+    оно добавляется по событию, а их содержимое сразу считается изменённым.
+    При переполнении очереди ядра возвращается весь список файлов.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, "inotify недоступен.")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify недоступен.")
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "Не удалось создать inotify.")
+        self._dirs = {}  # Дескриптор наблюдения -> путь директории
+        try:
+            for directory in _walk_dirs(root):
+                self._add_watch(directory)
+        except BaseException:
+            self.close()
+            raise
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return  # Директория уже удалена или недоступна
+            # ENOSPC — исчерпан лимит наблюдений (fs.inotify.max_user_watches)
+            raise OSError(error, os.strerror(error), directory)
+        self._dirs[wd] = directory
+
+    def wait(self, timeout):
+        """Ждёт события до timeout секунд и возвращает пути изменённых файлов."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        changed = []
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            position = 0
+            while position < len(data):
+                wd, mask, _, name_len = _EVENT.unpack_from(data, position)
+                position += _EVENT.size
+                name = os.fsdecode(data[position:position + name_len].rstrip(b'\0'))
+                position += name_len
+                if mask & _IN_Q_OVERFLOW:
+                    return list(encryption.iter_files(self.root))
+                if mask & _IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                directory = self._dirs.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & _IN_ISDIR:
+                    if mask & (_IN_CREATE | _IN_MOVED_TO):
+                        # Файлы могли появиться до того, как поставлено наблюдение
+                        for subdirectory in _walk_dirs(path):
+                            self._add_watch(subdirectory)
+                        changed.extend(encryption.iter_files(path))
+                else:
+                    changed.append(path)
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingSource:
+    """Изменения дерева по размеру и времени изменения файлов.
+
+    Дерево обходится через os.scandir не чаще раза в interval секунд;
+    изменёнными считаются новые файлы и файлы с другими размером или
+    временем изменения.
+    """
+
+    def __init__(self, root, interval=POLL_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self._state = self._scan()
+        self._scanned_at = time.monotonic()
+
+    def _scan(self):
+        state = {}
+        for directory in _walk_dirs(self.root):
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_file(follow_symlinks=False) and not encryption.is_reserved_name(entry.name):
+                            st = entry.stat(follow_symlinks=False)
+                            state[entry.path] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+        return state
+
+    def wait(self, timeout):
+        """Ждёт до timeout секунд; если подошёл срок обхода — возвращает изменения."""
+        remaining = self._scanned_at + self.interval - time.monotonic()
+        if remaining > 0:
+            time.sleep(min(timeout, remaining))
+            if remaining > timeout:
+                return []
+        state = self._scan()
+        self._scanned_at = time.monotonic()
+        changed = [path for path, seen in state.items() if self._state.get(path) != seen]
+        self._state = state
+        return changed
+
+    def close(self):
+        pass
+
+
+def open_source(root, poll_interval=POLL_INTERVAL, use_inotify=True):
+    """Возвращает InotifySource, а если inotify недоступен — PollingSource."""
+    if use_inotify:
+        try:
+            return InotifySource(root)
+        except OSError:
+            pass
+    return PollingSource(root, poll_interval)
+
+
+class Watcher:
+    """Шифрует новые и изменённые файлы в root пакетами после затишья.
+
+    Ключ (обычно KeyChain) выводится один раз и используется для всех
+    пакетов. Файлы, которые ещё дописываются, остаются в очереди до
+    следующей проверки. Уже зашифрованные файлы (в том числе результаты
+    самого наблюдателя) пропускаются. Остальные именованные параметры
+    передаются в encrypt_paths (workers, compression, cipher и т. д.).
+    """
+
+    def __init__(self, root, key, quiet=QUIET_SECONDS, stable=STABLE_SECONDS,
+                 poll_interval=POLL_INTERVAL, use_inotify=True, progress=None, **options):
+        self.root = os.path.abspath(root)
+        self.key = key
+        self.quiet = quiet
+        self.stable = stable
+        self.progress = progress
+        self.options = options
+        self.poll_interval = poll_interval
+        self.source = open_source(self.root, poll_interval, use_inotify)
+        self._pending = {}  # Путь -> ((размер, время изменения), когда замечены) или None
+        self._last_event = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.source.close()
+
+    def add(self, paths):
+        """Ставит файлы в очередь, как если бы о них пришли события."""
+        for path in paths:
+            if not encryption.is_reserved_name(os.path.basename(path)):
+                self._pending.setdefault(path, None)
+                self._last_event = time.monotonic()
+
+    def _wait_changes(self, timeout):
+        try:
+            return self.source.wait(timeout)
+        except OSError as e:
+            if e.errno != errno.ENOSPC:
+                raise
+        # Новой директории не хватило наблюдения inotify (fs.inotify.max_user_watches):
+        # дальше дерево обходится, а всё, что могло быть пропущено, проверяется заново
+        self.source.close()
+        self.source = PollingSource(self.root, self.poll_interval)
+        return list(encryption.iter_files(self.root))
+
+    def _take_stable(self):
+        """Забирает из очереди дописанные файлы; недописанные остаются."""
+        ready = []
+        now = time.monotonic()
+        for path, seen in list(self._pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._pending[path]  # Файл удалён или переименован
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                del self._pending[path]
+                continue
+            state = (st.st_size, st.st_mtime_ns)
+            if seen is None or seen[0] != state:
+                self._pending[path] = (state, now)
+                continue
+            if now - seen[1] < self.stable:
+                continue
+            del self._pending[path]
+            ready.append(path)
+        return ready
+
+    def poll(self, timeout=_TICK):
+        """Один шаг наблюдения: ждёт события и при затишье шифрует готовый пакет.
+
+        Возвращает JobSummary пакета или None, если шифровать было нечего.
+        """
+        self.add(self._wait_changes(min(timeout, self.quiet) if self._pending else timeout))
+        if not self._pending or time.monotonic() - self._last_event < self.quiet:
+            return None
+        ready = self._take_stable()
+        if not ready:
+            return None
+        plan = encryption.scan_paths(ready, ManifestSet([self.root]))
+        plan.entries = [entry for entry in plan.entries if not entry.encrypted]
+        if not plan.entries and not plan.failures:
+            return None
+        return encryption.encrypt_paths([self.root], self.key, progress=self.progress, plan=plan, **self.options)
+
+    def run(self, stop_event=None, on_batch=None):
+        """Наблюдает, пока не установлен stop_event или пока носитель не извлечён.
+
+        on_batch(summary) вызывается после каждого зашифрованного пакета.
+        """
+        while not (stop_event is not None and stop_event.is_set()):
+            if not os.path.isdir(self.root):
+                return
+            summary = self.poll()
+            if summary is not None and on_batch is not None:
+                on_batch(summary)
+
+
+def watch(root, key, stop_event=None, on_batch=None, **options):
+    """Запускает наблюдение за root до stop_event (см. Watcher)."""
+    with Watcher(root, key, **options) as watcher:
+        watcher.run(stop_event, on_batch)